@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import DateTime, delete, insert, literal, select
+
+from . import models
+from .cache import cache
+from .database import AsyncSessionLocal
+from .deployment_events import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true").lower() == "true"
+# Terminal deployments created more than this many days ago are archived
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+# Seconds between two archival runs
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+# Rows moved per transaction, and the pause between two transactions
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.1"))
+
+ARCHIVED_COLUMNS = [
+    "id",
+    "service_id",
+    "version",
+    "task_id",
+    "status",
+    "created_at",
+    "completed_at",
+    "details",
+]
+
+
+class DeploymentArchiver:
+    """
+    Periodically moves terminal deployments older than after_days from
+    `deployments` to `deployments_archive`. Each batch is copied and deleted
+    in its own short transaction, so row locks are held for one batch at a
+    time; rows locked by another API process are skipped.
+    """
+
+    def __init__(
+        self,
+        after_days: float = ARCHIVE_AFTER_DAYS,
+        interval: float = ARCHIVE_INTERVAL,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+        batch_pause: float = ARCHIVE_BATCH_PAUSE,
+    ):
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.archive()
+            except Exception:
+                logger.exception("Deployment archival failed")
+            await asyncio.sleep(self.interval)
+
+    async def archive(self) -> int:
+        """
+        Archives every eligible deployment, batch by batch, and returns how
+        many were moved
+        """
+        cutoff = datetime.utcnow() - timedelta(days=self.after_days)
+        total = 0
+        while True:
+            moved = await self.archive_batch(cutoff)
+            total += moved
+            if moved < self.batch_size:
+                break
+            await asyncio.sleep(self.batch_pause)
+        if total:
+            logger.info("Archived %d deployments created before %s", total, cutoff)
+        return total
+
+    async def archive_batch(self, cutoff: datetime) -> int:
+        async with AsyncSessionLocal() as db:
+            async with db.begin():
+                rows = (
+                    await db.execute(
+                        select(models.Deployment.id, models.Deployment.service_id)
+                        .where(
+                            models.Deployment.status.in_(TERMINAL_STATUSES),
+                            models.Deployment.created_at < cutoff,
+                        )
+                        .order_by(models.Deployment.created_at)
+                        .limit(self.batch_size)
+                        .with_for_update(skip_locked=True)
+                    )
+                ).all()
+                if not rows:
+                    return 0
+                ids = [row.id for row in rows]
+                await db.execute(
+                    insert(models.DeploymentArchive).from_select(
+                        ARCHIVED_COLUMNS + ["archived_at"],
+                        select(
+                            *(
+                                getattr(models.Deployment, column)
+                                for column in ARCHIVED_COLUMNS
+                            ),
+                            literal(datetime.utcnow(), DateTime),
+                        ).where(models.Deployment.id.in_(ids)),
+                    )
+                )
+                await db.execute(
+                    delete(models.Deployment)
+                    .where(models.Deployment.id.in_(ids))
+                    .execution_options(synchronize_session=False)
+                )
+        # Cached service responses embed their deployments
+        await cache.bump({row.service_id for row in rows})
+        return len(rows)
+
+
+archiver = DeploymentArchiver()
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSCache:
+    """
+    Auth0 signing keys indexed by kid, fetched without blocking the event
+    loop. The key set is refreshed in the background every ttl seconds, and
+    an unknown kid (key rotation) triggers an immediate refetch. Concurrent
+    refetches share a single request, and unknown kids refetch at most once
+    per min_refetch_interval so made-up kids cannot hammer the JWKS endpoint.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        ttl: float,
+        min_refetch_interval: float,
+        timeout: float = 5,
+    ):
+        self.url = url
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.timeout = timeout
+        self.keys: Dict[str, dict] = {}
+        self._fetched_at = float("-inf")
+        self._fetch: Optional[asyncio.Task] = None
+        self._refresher: Optional[asyncio.Task] = None
+        _jwks_caches.add(self)
+
+    async def get_key(self, kid: str) -> Optional[dict]:
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_periodically())
+        if not self.keys:
+            await self.refresh()
+        elif (
+            kid not in self.keys
+            and time.monotonic() - self._fetched_at >= self.min_refetch_interval
+        ):
+            await self.refresh()
+        return self.keys.get(kid)
+
+    async def refresh(self):
+        """
+        Refetches the key set; callers arriving while a fetch is in flight
+        wait for that one instead of starting their own
+        """
+        if self._fetch is None:
+            self._fetch = asyncio.create_task(self._load())
+            self._fetch.add_done_callback(self._clear_fetch)
+        await asyncio.shield(self._fetch)
+
+    def _clear_fetch(self, task: asyncio.Task):
+        self._fetch = None
+
+    async def _load(self):
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(self.url)
+            response.raise_for_status()
+            jwks = response.json()
+        self.keys = {
+            key["kid"]: {
+                "kty": key["kty"],
+                "kid": key["kid"],
+                "n": key["n"],
+                "e": key["e"],
+            }
+            for key in jwks["keys"]
+            if "kid" in key
+        }
+        self._fetched_at = time.monotonic()
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(
+                max(0.0, self._fetched_at + self.ttl - time.monotonic())
+            )
+            try:
+                await self.refresh()
+            except Exception as e:
+                # Keep serving the current keys; retry after another ttl
+                logger.warning("JWKS refresh failed: %s", e)
+                self._fetched_at = time.monotonic()
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+
+# Every key cache, so the app can stop their refreshers on shutdown without
+# importing the Auth0 settings
+_jwks_caches: "weakref.WeakSet[JWKSCache]" = weakref.WeakSet()
+
+
+async def stop_jwks_caches():
+    for jwks in list(_jwks_caches):
+        await jwks.stop()
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of the claims of tokens whose signature and claims were
+    already verified, keyed by a hash of the token. An entry is only served
+    until the token's exp.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        claims, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return claims
+
+    def set(self, token: str, claims: dict):
+        if self.max_entries <= 0 or not isinstance(claims.get("exp"), (int, float)):
+            return
+        key = self._key(token)
+        self._entries[key] = (claims, float(claims["exp"]))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -6,6 +6,12 @@ class AuthSettings(BaseSettings):
     AUTH0_CLIENT_ID: str
     AUTH0_CLIENT_SECRET: str
     AUTH0_ALGORITHMS: list = ["RS256"]
+    # Seconds between background refreshes of the signing keys
+    AUTH0_JWKS_TTL: int = 3600
+    # Minimum seconds between refetches triggered by an unknown kid
+    AUTH0_JWKS_MIN_REFETCH_INTERVAL: int = 30
+    # Number of verified tokens whose claims are kept until they expire
+    AUTH0_TOKEN_CACHE_SIZE: int = 10000
 
     class Config:
         env_file = ".env"
@@ -1,8 +1,8 @@
-import requests
 from fastapi import HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import jwt
 
+from .cache import JWKSCache, VerifiedTokenCache
 from .config import auth_settings
 
 
@@ -10,8 +10,13 @@ class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super(JWTBearer, self).__init__(auto_error=auto_error)
 
-        # Auth0 public key cache
-        self._jwks = None
+        # Auth0 public keys by kid, and claims of already verified tokens
+        self._jwks = JWKSCache(
+            f"https://{auth_settings.AUTH0_DOMAIN}/.well-known/jwks.json",
+            ttl=auth_settings.AUTH0_JWKS_TTL,
+            min_refetch_interval=auth_settings.AUTH0_JWKS_MIN_REFETCH_INTERVAL,
+        )
+        self._verified = VerifiedTokenCache(auth_settings.AUTH0_TOKEN_CACHE_SIZE)
 
     async def __call__(self, request: Request):
         credentials: HTTPAuthorizationCredentials = await super(
@@ -27,34 +32,23 @@ class JWTBearer(HTTPBearer):
             )
 
         try:
-            payload = self.decode_jwt(credentials.credentials)
+            payload = await self.decode_jwt(credentials.credentials)
         except Exception as e:
             raise HTTPException(status_code=403, detail=str(e))
 
         return payload
 
-    def decode_jwt(self, token: str) -> dict:
-        if not self._jwks:
-            self._jwks = requests.get(
-                f"https://{auth_settings.AUTH0_DOMAIN}/.well-known/jwks.json"
-            ).json()
+    async def decode_jwt(self, token: str) -> dict:
+        payload = self._verified.get(token)
+        if payload is not None:
+            return payload
 
         try:
             unverified_header = jwt.get_unverified_header(token)
         except jwt.JWTError:
             raise HTTPException(status_code=403, detail="Invalid token header")
 
-        rsa_key = {}
-        for key in self._jwks["keys"]:
-            if key["kid"] == unverified_header["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "n": key["n"],
-                    "e": key["e"],
-                }
-                break
-
+        rsa_key = await self._jwks.get_key(unverified_header.get("kid"))
         if not rsa_key:
             raise HTTPException(
                 status_code=403, detail="Unable to find appropriate key"
@@ -75,6 +69,7 @@ class JWTBearer(HTTPBearer):
         except Exception:
             raise HTTPException(status_code=403, detail="Unable to parse token")
 
+        self._verified.set(token, payload)
         return payload
 
 
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import redis.asyncio as aioredis
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", f"redis://{REDIS_HOST}:6379/1")
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+# Seconds a cached response lives
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+# Maximum number of cached responses; the oldest are evicted first
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+# Responses larger than this are served but never cached
+CACHE_MAX_ENTRY_BYTES = int(os.getenv("CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+# Seconds reads skip Redis after a Redis error, instead of each waiting for it
+CACHE_FAILURE_COOLDOWN = float(os.getenv("CACHE_FAILURE_COOLDOWN", "5"))
+
+COLLECTION = "services"
+
+
+class ResponseCache:
+    """
+    Read-through cache for serialized service responses.
+
+    Every cached entry is keyed by a version counter: one for the services
+    collection and one per service. Writers bump the counters instead of
+    deleting entries, so a bump invalidates every dependent response at once
+    and the counter doubles as the ETag. Stale versions simply age out through
+    the TTL or the size bound.
+
+    After a Redis error, lookups and writes skip Redis (serving from the
+    database) for failure_cooldown seconds, so an outage costs one timeout
+    per cooldown rather than one per request. Version bumps are always
+    attempted: a skipped one would leave stale entries once Redis is back.
+    """
+
+    def __init__(
+        self,
+        url: str = CACHE_REDIS_URL,
+        enabled: bool = CACHE_ENABLED,
+        ttl: int = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_entry_bytes: int = CACHE_MAX_ENTRY_BYTES,
+        failure_cooldown: float = CACHE_FAILURE_COOLDOWN,
+    ):
+        self.url = url
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self.failure_cooldown = failure_cooldown
+        self.redis: Optional[aioredis.Redis] = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.errors = 0
+        # Redis calls skipped during a failure cooldown
+        self.skipped = 0
+        self._down_until = float("-inf")
+
+    def get_redis(self) -> aioredis.Redis:
+        if self.redis is None:
+            self.redis = aioredis.from_url(
+                self.url, socket_connect_timeout=1, socket_timeout=1
+            )
+        return self.redis
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    def _available(self) -> bool:
+        if time.monotonic() < self._down_until:
+            self.skipped += 1
+            return False
+        return True
+
+    def _failed(self, message: str, error: RedisError, sample: str):
+        self.errors += 1
+        self._down_until = time.monotonic() + self.failure_cooldown
+        logger.warning("%s: %s", message, error, extra={"sample": sample})
+
+    @staticmethod
+    def _version_key(entity_id: Optional[int]) -> str:
+        if entity_id is None:
+            return f"cache:version:{COLLECTION}"
+        return f"cache:version:service:{entity_id}"
+
+    @staticmethod
+    def params_digest(params: Iterable[Tuple[str, str]]) -> str:
+        canonical = "&".join(f"{key}={value}" for key, value in sorted(params))
+        return hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+
+    async def get_version(self, entity_id: Optional[int] = None) -> Optional[int]:
+        """
+        Current version of the collection (entity_id=None) or of one service.
+        None means the cache is unavailable and callers should bypass it.
+        """
+        if not self.enabled or not self._available():
+            return None
+        try:
+            version = await self.get_redis().get(self._version_key(entity_id))
+        except RedisError as e:
+            self._failed("Cache unavailable", e, "cache_unavailable")
+            return None
+        return int(version or 0)
+
+    @staticmethod
+    def etag(name: str, version: int, digest: str = "") -> str:
+        return f'"{name}-v{version}{"-" + digest if digest else ""}"'
+
+    async def get(self, key: str) -> Optional[Dict[str, bytes]]:
+        entry = None
+        if self._available():
+            try:
+                entry = await self.get_redis().hgetall(key)
+            except RedisError as e:
+                self._failed("Cache read failed", e, "cache_error")
+        if entry:
+            self.hits += 1
+            return {field.decode(): value for field, value in entry.items()}
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, body: bytes, headers: Dict[str, str]):
+        if len(body) > self.max_entry_bytes or not self._available():
+            return
+        try:
+            redis = self.get_redis()
+            # Sorted set of cached keys by insertion time, used for the size bound
+            index_key = "cache:index"
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(key, mapping={"body": body, **headers})
+                pipe.expire(key, self.ttl)
+                pipe.zadd(index_key, {key: time.time()})
+                pipe.zcard(index_key)
+                _, _, _, size = await pipe.execute()
+            if size > self.max_entries:
+                evicted = await redis.zpopmin(index_key, size - self.max_entries)
+                if evicted:
+                    await redis.delete(*(member for member, _ in evicted))
+        except RedisError as e:
+            self._failed("Cache write failed", e, "cache_error")
+
+    async def bump(self, entity_ids: Iterable[int] = ()):
+        """
+        Invalidates the services collection and the given services
+        """
+        if not self.enabled:
+            return
+        try:
+            async with self.get_redis().pipeline(transaction=False) as pipe:
+                pipe.incr(self._version_key(None))
+                for entity_id in entity_ids:
+                    pipe.incr(self._version_key(entity_id))
+                await pipe.execute()
+        except RedisError as e:
+            self._failed("Cache invalidation failed", e, "cache_error")
+
+    async def respond(
+        self,
+        request: Request,
+        key: str,
+        etag: Optional[str],
+        build: Callable[[], Awaitable[Tuple[Any, Dict[str, str]]]],
+    ) -> Response:
+        """
+        Serves a JSON response through the cache. build() loads the content
+        and extra headers on a miss. Pass etag=None (unknown version) to
+        bypass the cache entirely.
+        """
+        if etag is None:
+            content, headers = await build()
+            return json_response(encode_json(content), headers)
+
+        if etag in _parse_if_none_match(request.headers.get("if-none-match")):
+            self.not_modified += 1
+            return Response(status_code=304, headers={"ETag": etag})
+
+        entry = await self.get(key)
+        if entry is not None:
+            body = entry.pop("body")
+            headers = {field: value.decode() for field, value in entry.items()}
+        else:
+            content, headers = await build()
+            body = encode_json(content)
+            await self.set(key, body, headers)
+
+        return json_response(
+            body, {**headers, "ETag": etag, "Cache-Control": "no-cache"}
+        )
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "skipped": self.skipped,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def encode_json(content: Any) -> bytes:
+    # Same encoding as fastapi's JSONResponse
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def json_response(body: bytes, headers: Dict[str, str]) -> Response:
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _parse_if_none_match(value: Optional[str]) -> Tuple[str, ...]:
+    if not value:
+        return ()
+    return tuple(
+        tag.strip().removeprefix("W/") for tag in value.split(",") if tag.strip()
+    )
+
+
+cache = ResponseCache()
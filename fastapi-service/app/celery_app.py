@@ -1,9 +1,21 @@
+import json
+import logging
+import os
 import time
+from contextlib import contextmanager
 from enum import Enum
 
 import httpx
+import redis
 import semver
-from celery import Celery
+from celery import Celery, states
+from celery.signals import setup_logging as celery_setup_logging
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+
+from .logging_config import correlation_id, setup_logging, stop_logging
+from .metrics import record_stage_durations
+
+logger = logging.getLogger(__name__)
 
 
 class DeploymentStatus(str, Enum):
@@ -13,9 +25,14 @@ class DeploymentStatus(str, Enum):
     FAILED = "failed"
 
 
-celery_app = Celery(
-    "tooling_worker", broker="redis://redis:6379/0", backend="redis://redis:6379/0"
-)
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+CELERY_REDIS_URL = f"redis://{REDIS_HOST}:6379/0"
+# Pub/sub channel the worker announces finished deployments on
+DEPLOYMENT_EVENTS_CHANNEL = "deployment_events"
+
+celery_app = Celery("tooling_worker", broker=CELERY_REDIS_URL, backend=CELERY_REDIS_URL)
+
+_redis = None
 
 
 def validate_semantic_version(current_version: str, new_version: str) -> bool:
@@ -30,68 +47,327 @@ def validate_semantic_version(current_version: str, new_version: str) -> bool:
         return False
 
 
-@celery_app.task
-def deploy_service(service_id: int, service_url: str, new_version: str):
+class DeploymentStage(str, Enum):
+    PRECHECK = "precheck"
+    BACKUP = "backup"
+    MIGRATION = "migration"
+    UPDATE = "update"
+    VERIFY = "verify"
+
+
+STAGE_ORDER = list(DeploymentStage)
+# Simulated duration of each stage. The next stage is scheduled with this
+# countdown instead of sleeping, so no worker slot is held while waiting.
+STAGE_DURATIONS = {
+    DeploymentStage.PRECHECK: 2,
+    DeploymentStage.BACKUP: 3,
+    DeploymentStage.MIGRATION: 4,
+}
+# Checkpoints of abandoned deployments expire after this many seconds
+CHECKPOINT_TTL = 24 * 60 * 60
+# Retries of a stage that failed on a network error
+MAX_STAGE_RETRIES = 3
+# Stages that can safely run again: they only read from the service. The
+# others are only retried if their request never reached it.
+IDEMPOTENT_STAGES = {
+    DeploymentStage.PRECHECK,
+    DeploymentStage.BACKUP,
+    DeploymentStage.VERIFY,
+}
+
+
+class DeploymentFailed(Exception):
+    pass
+
+
+def is_retryable(stage: DeploymentStage, error: Exception) -> bool:
+    """
+    Whether a stage that raised error may be repeated. A timeout or dropped
+    connection during the update may come after the service applied it.
+    """
+    if not isinstance(error, httpx.TransportError):
+        return False
+    return stage in IDEMPOTENT_STAGES or isinstance(
+        error, (httpx.ConnectError, httpx.ConnectTimeout)
+    )
+
+
+def _get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(CELERY_REDIS_URL)
+    return _redis
+
+
+def _checkpoint_key(task_id: str) -> str:
+    return f"deployment:checkpoint:{task_id}"
+
+
+def load_checkpoint(task_id: str) -> dict:
+    try:
+        raw = _get_redis().get(_checkpoint_key(task_id))
+    except redis.RedisError as e:
+        logger.warning("Failed to load checkpoint for %s: %s", task_id, e)
+        raw = None
+    if raw:
+        return json.loads(raw)
+    return {"completed": [], "context": {}}
+
+
+def save_checkpoint(task_id: str, checkpoint: dict):
+    try:
+        _get_redis().set(
+            _checkpoint_key(task_id), json.dumps(checkpoint), ex=CHECKPOINT_TTL
+        )
+    except redis.RedisError as e:
+        # The deployment still proceeds, it just cannot resume mid-way
+        logger.warning("Failed to save checkpoint for %s: %s", task_id, e)
+
+
+def clear_checkpoint(task_id: str):
+    try:
+        _get_redis().delete(_checkpoint_key(task_id))
+    except redis.RedisError as e:
+        logger.warning("Failed to clear checkpoint for %s: %s", task_id, e)
+
+
+def _precheck(
+    client: httpx.Client,
+    service_url: str,
+    new_version: str,
+    context: dict,
+    timings: dict,
+):
+    # Get current service info
+    with timed(timings, "health_read"):
+        response = client.get(f"{service_url}/api/health/info")
+        current_info = response.json()
+
+    # Validate version
+    with timed(timings, "semver_validation"):
+        valid = validate_semantic_version(current_info["release"], new_version)
+    if not valid:
+        raise DeploymentFailed("Invalid version upgrade")
+    context["current_info"] = current_info
+
+
+def _backup(
+    client: httpx.Client,
+    service_url: str,
+    new_version: str,
+    context: dict,
+    timings: dict,
+):
+    # Simulated, see STAGE_DURATIONS
+    pass
+
+
+def _migrate(
+    client: httpx.Client,
+    service_url: str,
+    new_version: str,
+    context: dict,
+    timings: dict,
+):
+    # Simulated, see STAGE_DURATIONS
+    pass
+
+
+def _update(
+    client: httpx.Client,
+    service_url: str,
+    new_version: str,
+    context: dict,
+    timings: dict,
+):
+    try:
+        update_response = client.post(
+            f"{service_url}/api/update",
+            json={
+                "platform": context["current_info"]["platform"],
+                "release": new_version,
+                "schema": f"schema_{new_version.replace('.', '_')}",
+            },
+        )
+        update_response.raise_for_status()
+    except httpx.TransportError:
+        raise
+    except Exception as e:
+        raise DeploymentFailed(f"Failed to update service: {str(e)}")
+
+
+def _verify(
+    client: httpx.Client,
+    service_url: str,
+    new_version: str,
+    context: dict,
+    timings: dict,
+):
+    # Final health check
+    check_response = client.get(f"{service_url}/api/health/info")
+    final_info = check_response.json()
+
+    if final_info["release"] != new_version:
+        raise DeploymentFailed("Version mismatch after deployment")
+    context["final_info"] = final_info
+
+
+@contextmanager
+def timed(timings: dict, name: str):
+    """
+    Adds the monotonic duration of the block to timings[name], in seconds
     """
-    Simulates a deployment process with the following steps:
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timings[name] = round(timings.get(name, 0) + time.monotonic() - started, 4)
+
+
+STAGE_HANDLERS = {
+    DeploymentStage.PRECHECK: _precheck,
+    DeploymentStage.BACKUP: _backup,
+    DeploymentStage.MIGRATION: _migrate,
+    DeploymentStage.UPDATE: _update,
+    DeploymentStage.VERIFY: _verify,
+}
+
+
+@celery_app.task(
+    bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=MAX_STAGE_RETRIES
+)
+def deploy_service(self, service_id: int, service_url: str, new_version: str):
+    """
+    Runs one stage of the deployment pipeline per invocation:
     1. Pre-deployment checks
     2. Backup
     3. Schema migration
     4. Service update
     5. Health check
+
+    Completed stages are checkpointed in Redis under the task ID, and the task
+    replaces itself (keeping its ID) with the next stage after the stage's
+    countdown. A retried or re-delivered task resumes after the last
+    completed stage instead of starting over.
+
+    Progress is reported as state PROGRESS with the current stage and the
+    per-stage durations so far; the final result carries all durations.
     """
-    try:
-        with httpx.Client() as client:
-            # Get current service info
-            response = client.get(f"{service_url}/api/health/info")
-            current_info = response.json()
-
-            # Validate version
-            if not validate_semantic_version(current_info["release"], new_version):
-                return {
-                    "status": DeploymentStatus.FAILED.value,
-                    "error": "Invalid version upgrade",
-                }
-
-            # Simulate deployment process
-            time.sleep(2)  # Pre-deployment checks
-            time.sleep(3)  # Backup
-            time.sleep(4)  # Schema migration
-
-            # Update service
-            try:
-                update_response = client.post(
-                    f"{service_url}/api/update",
-                    json={
-                        "platform": current_info["platform"],
-                        "release": new_version,
-                        "schema": f"schema_{new_version.replace('.', '_')}",
-                    },
-                )
-                update_response.raise_for_status()
-            except Exception as e:
-                return {
-                    "status": DeploymentStatus.FAILED.value,
-                    "error": f"Failed to update service: {str(e)}",
-                }
-
-            # Final health check
-            check_response = client.get(f"{service_url}/api/health/info")
-            final_info = check_response.json()
-
-            if final_info["release"] != new_version:
-                return {
-                    "status": DeploymentStatus.FAILED.value,
-                    "error": "Version mismatch after deployment",
-                }
-
-            return {
-                "status": DeploymentStatus.SUCCESS.value,
-                "info": final_info,
-            }
+    task_id = self.request.id
+    checkpoint = load_checkpoint(task_id)
+    completed = checkpoint["completed"]
+    timings = checkpoint.setdefault("timings", {})
+    scheduled_at = checkpoint.pop("scheduled_at", None)
+    if scheduled_at is not None and completed:
+        # The countdown (simulated duration) and queueing delay belong to the
+        # stage that scheduled this one. Wall clock, as stages may run on
+        # different workers.
+        timings[completed[-1]] = round(
+            timings.get(completed[-1], 0) + max(0.0, time.time() - scheduled_at), 4
+        )
+    stage = next(stage for stage in STAGE_ORDER if stage.value not in completed)
+    self.update_state(
+        state="PROGRESS",
+        meta={"stage": stage.value, "completed": completed, "timings": timings},
+    )
 
+    try:
+        with httpx.Client() as client, timed(timings, stage.value):
+            STAGE_HANDLERS[stage](
+                client, service_url, new_version, checkpoint["context"], timings
+            )
     except Exception as e:
+        if is_retryable(stage, e) and self.request.retries < self.max_retries:
+            # Resumes from the checkpoint: only this stage is repeated
+            save_checkpoint(task_id, checkpoint)
+            raise self.retry(exc=e, countdown=2**self.request.retries)
+        logger.warning("Deployment stage %s failed: %s", stage.value, e)
+        clear_checkpoint(task_id)
         return {
             "status": DeploymentStatus.FAILED.value,
             "error": str(e),
+            "timings": timings,
         }
+
+    completed.append(stage.value)
+    logger.info("Deployment stage %s completed", stage.value)
+    if stage == STAGE_ORDER[-1]:
+        clear_checkpoint(task_id)
+        return {
+            "status": DeploymentStatus.SUCCESS.value,
+            "info": checkpoint["context"]["final_info"],
+            "timings": timings,
+        }
+
+    checkpoint["scheduled_at"] = time.time()
+    save_checkpoint(task_id, checkpoint)
+    next_stage = deploy_service.si(service_id, service_url, new_version).set(
+        countdown=STAGE_DURATIONS.get(stage, 0)
+    )
+    if self.request.is_eager:
+        # task_always_eager: replace() would join the next stage with sync
+        # subtasks disallowed and fail, so run it inline under the same ID
+        return next_stage.apply(task_id=task_id).get(disable_sync_subtasks=False)
+    return self.replace(next_stage)
+
+
+@celery_setup_logging.connect
+def configure_worker_logging(**kwargs):
+    """
+    Connected so Celery leaves the root logger alone; worker logs go through
+    the same queued pipeline as the API's
+    """
+    setup_logging()
+
+
+@worker_process_shutdown.connect
+def flush_worker_logs(**kwargs):
+    # Pool processes exit without running atexit handlers
+    stop_logging()
+
+
+@task_prerun.connect(sender=deploy_service)
+def bind_deployment_correlation_id(task_id=None, **kwargs):
+    # The task keeps its ID across stages, so it identifies the deployment
+    correlation_id.set(task_id)
+
+
+@task_postrun.connect(sender=deploy_service)
+def publish_deployment_result(
+    task_id=None, args=None, retval=None, state=None, **kwargs
+):
+    """
+    Announces the outcome on DEPLOYMENT_EVENTS_CHANNEL so the API can update
+    the Deployment row and notify clients without being polled
+    """
+    if state not in (states.SUCCESS, states.FAILURE) or (
+        state == states.SUCCESS and not isinstance(retval, dict)
+    ):
+        # Stage handed over to the next one (replaced) or scheduled for retry
+        return
+    if isinstance(retval, dict):
+        result = retval
+    else:
+        result = {"status": DeploymentStatus.FAILED.value, "error": str(retval)}
+    record_stage_durations(result.get("timings"))
+    try:
+        _get_redis().publish(
+            DEPLOYMENT_EVENTS_CHANNEL,
+            json.dumps(
+                {
+                    "task_id": task_id,
+                    "service_id": args[0] if args else None,
+                    "result": result,
+                },
+                default=str,
+            ),
+        )
+    except redis.RedisError as e:
+        # Clients can still resolve the deployment through the status endpoint
+        logger.warning("Failed to publish deployment result for %s: %s", task_id, e)
+
+
+# Connected after publish_deployment_result so its logs still carry the ID
+@task_postrun.connect(sender=deploy_service)
+def unbind_deployment_correlation_id(**kwargs):
+    correlation_id.set("-")
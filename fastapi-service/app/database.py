@@ -1,61 +1,188 @@
+import asyncio
+import logging
 import os
 import time
+from contextlib import AsyncExitStack
+from typing import Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-from .models import Base
+from .metrics import db_pool_checkout_wait
+from .migrations import SCHEMA_VERSION, migrate, schema_version
+
+logger = logging.getLogger(__name__)
 
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_USER = os.getenv("DB_USER", "root")
 DB_PASS = os.getenv("DB_PASS", "")
 DB_NAME = os.getenv("DB_NAME", "mydb")
 
-SQLALCHEMY_DATABASE_URL = (
-    f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:3306/{DB_NAME}"
+# DATABASE_URL / ASYNC_DATABASE_URL replace the MySQL URLs built from the
+# DB_* settings, e.g. to run against SQLite
+SQLALCHEMY_DATABASE_URL = os.getenv(
+    "DATABASE_URL", f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:3306/{DB_NAME}"
+)
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv(
+    "ASYNC_DATABASE_URL",
+    f"mysql+aiomysql://{DB_USER}:{DB_PASS}@{DB_HOST}:3306/{DB_NAME}",
 )
 
-# Maximum number of retries
-MAX_RETRIES = 30
-# Delay between retries in seconds
-RETRY_DELAY = 1
+# Connection pool settings, shared by the sync and async engines
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# Seconds before a pooled connection is replaced (below MySQL's wait_timeout)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_pre_ping": True,
+}
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # Pooled SQLite connections are handed between threads
+    POOL_OPTIONS["connect_args"] = {"check_same_thread": False}
+
+
+class CheckoutTimer:
+    """
+    Pool mixin recording how long each checkout waited for a connection
+    """
 
+    engine_label = ""
 
-def get_db_connection():
-    retries = 0
-    while retries < MAX_RETRIES:
+    def _do_get(self):
+        started = time.perf_counter()
         try:
-            engine = create_engine(
-                SQLALCHEMY_DATABASE_URL,
-                echo=False,
-                future=True,
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait[(self.engine_label,)].observe(
+                time.perf_counter() - started
             )
-            # Try to connect
-            with engine.connect() as connection:
-                # If successful, create tables and return engine
-                Base.metadata.create_all(bind=engine)
-                return engine
-        except OperationalError as e:
-            retries += 1
-            if retries < MAX_RETRIES:
-                print(
-                    f"Database connection attempt {retries} failed. Retrying in {RETRY_DELAY} seconds..."
-                )
-                time.sleep(RETRY_DELAY)
-            else:
-                raise Exception(
-                    "Could not connect to database after maximum retries"
-                ) from e
 
 
-engine = get_db_connection()
+class TimedQueuePool(CheckoutTimer, QueuePool):
+    engine_label = "sync"
+
+
+class TimedAsyncQueuePool(CheckoutTimer, AsyncAdaptedQueuePool):
+    engine_label = "async"
+
+
+# Startup waits for the database with exponential backoff, from
+# DB_CONNECT_BACKOFF up to DB_CONNECT_BACKOFF_MAX seconds between attempts
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", "30"))
+DB_CONNECT_BACKOFF = float(os.getenv("DB_CONNECT_BACKOFF", "0.1"))
+DB_CONNECT_BACKOFF_MAX = float(os.getenv("DB_CONNECT_BACKOFF_MAX", "5"))
+# Connections opened in each pool before the API reports ready
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "5"))
+
+
+# Engines connect lazily; nothing here touches the database until
+# init_database() runs at startup
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    echo=False,
+    future=True,
+    poolclass=TimedQueuePool,
+    **POOL_OPTIONS,
+)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
 
+# Used by async routes, the health poller and other event-loop code. Sync
+# (def) routes keep using get_db; FastAPI runs them in its threadpool so
+# their blocking queries never run on the event loop.
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    echo=False,
+    poolclass=TimedAsyncQueuePool,
+    **POOL_OPTIONS,
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def wait_for_database() -> Optional[int]:
+    """
+    Retries until the database accepts connections and returns the schema
+    version recorded in it (None for a database without migrations)
+    """
+    delay = DB_CONNECT_BACKOFF
+    for attempt in range(1, DB_CONNECT_RETRIES + 1):
+        try:
+            async with async_engine.connect() as connection:
+                return await connection.run_sync(schema_version)
+        except (OperationalError, OSError) as e:
+            if attempt == DB_CONNECT_RETRIES:
+                raise Exception(
+                    "Could not connect to database after maximum retries"
+                ) from e
+            logger.warning(
+                "Database connection attempt %d failed. Retrying in %s seconds...",
+                attempt,
+                delay,
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, DB_CONNECT_BACKOFF_MAX)
+
+
+async def warm_pools(size: int = DB_POOL_WARMUP):
+    """
+    Opens `size` connections in each engine's pool, so the first requests
+    after startup do not pay for connection setup
+    """
+    size = min(size, DB_POOL_SIZE)
+    if size <= 0:
+        return
+
+    def open_sync():
+        connections = [engine.connect() for _ in range(size)]
+        for connection in connections:
+            connection.close()
+
+    # Held concurrently: sequential checkouts would reuse one connection
+    async with AsyncExitStack() as stack:
+        for _ in range(size):
+            connection = await stack.enter_async_context(async_engine.connect())
+            await connection.execute(text("SELECT 1"))
+    await asyncio.to_thread(open_sync)
+
+
+async def init_database():
+    """
+    Startup phase of the API: waits for the database, applies pending
+    migrations and warms the connection pools. The migration DDL checks are
+    skipped entirely when the recorded schema version is current.
+    """
+    version = await wait_for_database()
+    if version == SCHEMA_VERSION:
+        logger.info("Database schema is at version %d", version)
+    else:
+        await asyncio.to_thread(migrate, engine)
+    await warm_pools()
+
+
+async def dispose_engines():
+    await async_engine.dispose()
+    await asyncio.to_thread(engine.dispose)
@@ -0,0 +1,335 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+import redis.asyncio as aioredis
+from celery import states
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import cache
+from .celery_app import CELERY_REDIS_URL, DEPLOYMENT_EVENTS_CHANNEL, deploy_service
+from .database import AsyncSessionLocal
+from .logging_config import correlation_id
+from .websocket import manager
+
+logger = logging.getLogger(__name__)
+
+DEPLOYMENT_EVENTS_ENABLED = (
+    os.getenv("DEPLOYMENT_EVENTS_ENABLED", "true").lower() == "true"
+)
+TERMINAL_STATUSES = (models.DeploymentStatus.SUCCESS, models.DeploymentStatus.FAILED)
+# Size of the Deployment.details column, and how much of an error fits in it
+DETAILS_MAX_LENGTH = 500
+DETAILS_ERROR_LENGTH = 200
+# Seconds to wait before resubscribing after losing the Redis connection
+RESUBSCRIBE_DELAY = 5
+
+
+async def start_deployments(
+    db: AsyncSession, services: List[models.Service], version: str
+) -> List[models.Deployment]:
+    """
+    Creates one IN_PROGRESS deployment per service and sends its
+    deploy_service task. The rows and their task IDs are committed before the
+    tasks are sent, so the worker's completion event can always find them.
+    """
+    deployments = [
+        models.Deployment(
+            version=version,
+            service_id=service.id,
+            task_id=str(uuid4()),
+            status=models.DeploymentStatus.IN_PROGRESS,
+        )
+        for service in services
+    ]
+    db.add_all(deployments)
+    await db.commit()
+
+    sent: List[models.Deployment] = []
+
+    def send():
+        for service, deployment in zip(services, deployments):
+            deploy_service.apply_async(
+                (service.id, service.url, version), task_id=deployment.task_id
+            )
+            sent.append(deployment)
+
+    # Publishing to the broker is blocking I/O
+    try:
+        await asyncio.to_thread(send)
+    except Exception as e:
+        # No task will ever report on the unsent rows, which would otherwise
+        # stay IN_PROGRESS (and their services busy for rollouts) forever
+        for deployment in deployments[len(sent) :]:
+            deployment.status = models.DeploymentStatus.FAILED
+            deployment.completed_at = datetime.utcnow()
+            deployment.details = deployment_details(
+                {"error": f"Failed to send deployment task: {e}"}
+            )
+        await db.commit()
+        raise
+    return deployments
+
+
+def deployment_started_event(deployment: models.Deployment) -> dict:
+    """
+    WebSocket event announcing a deployment sent by start_deployments
+    """
+    return {
+        "type": "deployment_started",
+        "service_id": deployment.service_id,
+        "deployment_id": deployment.id,
+        "version": deployment.version,
+        "status": models.DeploymentStatus.IN_PROGRESS.value,
+    }
+
+
+def apply_deployment_result(
+    deployment: models.Deployment,
+    service: Optional[models.Service],
+    result: Dict[str, Any],
+) -> Optional[dict]:
+    """
+    Applies a finished deploy_service result to its Deployment (and, on
+    success, to the service version). Returns the deployment_completed event
+    to broadcast, or None if the result is not terminal.
+    """
+    status = models.DeploymentStatus(result["status"])
+    if status not in TERMINAL_STATUSES:
+        return None
+
+    deployment.status = status
+    deployment.completed_at = datetime.utcnow()
+    deployment.details = deployment_details(result)
+    if status == models.DeploymentStatus.SUCCESS:
+        # Update service version if deployment successful
+        if service is not None:
+            service.current_version = deployment.version
+        return {
+            "type": "deployment_completed",
+            "deployment_id": deployment.id,
+            "service_id": deployment.service_id,
+            "status": deployment.status,
+            "version": deployment.version,
+        }
+    return {
+        "type": "deployment_completed",
+        "deployment_id": deployment.id,
+        "service_id": deployment.service_id,
+        "status": "failed",
+        "error": result.get("error", "Unknown error"),
+    }
+
+
+def deployment_details(result: Dict[str, Any]) -> Optional[str]:
+    """
+    Serializes the per-stage durations (and error) of a result for
+    Deployment.details, keeping within the column size
+    """
+    details: Dict[str, Any] = {"timings": result.get("timings") or {}}
+    if result.get("error"):
+        details["error"] = str(result["error"])[:DETAILS_ERROR_LENGTH]
+    encoded = json.dumps(details, separators=(",", ":"))
+    if len(encoded) > DETAILS_MAX_LENGTH:
+        encoded = json.dumps({"timings": details["timings"]}, separators=(",", ":"))
+    return encoded if len(encoded) <= DETAILS_MAX_LENGTH else None
+
+
+def fetch_task_results(task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Results of the finished deploy_service tasks among task_ids, read from the
+    result backend with a single MGET. Unfinished tasks are left out.
+    """
+    if not task_ids:
+        return {}
+    backend = deploy_service.backend
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    values = backend.mget(keys)
+    if hasattr(values, "items"):
+        # Some key-value backends return a mapping instead of a list
+        values = [values.get(key) for key in keys]
+    results = {}
+    for task_id, value in zip(task_ids, values):
+        if value is None:
+            continue
+        meta = backend.decode_result(value)
+        if meta["status"] not in states.READY_STATES:
+            continue
+        result = meta["result"]
+        if meta["status"] != states.SUCCESS or not isinstance(result, dict):
+            result = {
+                "status": models.DeploymentStatus.FAILED.value,
+                "error": str(result),
+            }
+        results[task_id] = result
+    return results
+
+
+def complete_finished_deployments(
+    db: Session, deployments: List[models.Deployment]
+) -> List[dict]:
+    """
+    Resolves the non-terminal deployments against the result backend.
+    Terminal deployments are answered from the database alone. Returns the
+    events to broadcast; the caller commits all transitions at once.
+    """
+    pending = [
+        deployment
+        for deployment in deployments
+        if deployment.task_id and deployment.status not in TERMINAL_STATUSES
+    ]
+    results = fetch_task_results([deployment.task_id for deployment in pending])
+    finished = [deployment for deployment in pending if deployment.task_id in results]
+    if not finished:
+        return []
+    # Locked and re-read, so that a deployment completed meanwhile by the
+    # event listener of some API process is neither applied nor announced twice
+    locked = db.scalars(
+        select(models.Deployment)
+        .where(models.Deployment.id.in_([deployment.id for deployment in finished]))
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).all()
+    finished = [
+        deployment
+        for deployment in locked
+        if deployment.status not in TERMINAL_STATUSES
+    ]
+    if not finished:
+        return []
+
+    services = {
+        service.id: service
+        for service in db.scalars(
+            select(models.Service).where(
+                models.Service.id.in_(
+                    {deployment.service_id for deployment in finished}
+                )
+            )
+        )
+    }
+    messages = []
+    for deployment in finished:
+        message = apply_deployment_result(
+            deployment,
+            services.get(deployment.service_id),
+            results[deployment.task_id],
+        )
+        if message is not None:
+            messages.append(message)
+    return messages
+
+
+class DeploymentEventListener:
+    """
+    Subscribes to the results the Celery worker publishes on
+    DEPLOYMENT_EVENTS_CHANNEL and completes deployments as soon as their
+    task finishes, instead of waiting for a client to poll the status endpoint.
+    """
+
+    def __init__(
+        self, url: str = CELERY_REDIS_URL, channel: str = DEPLOYMENT_EVENTS_CHANNEL
+    ):
+        self.url = url
+        self.channel = channel
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self):
+        while True:
+            redis = aioredis.from_url(self.url)
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Results published while we were not subscribed are lost;
+                # pick them up from the result backend instead
+                await self.reconcile()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        await self.handle(json.loads(message["data"]))
+                    except Exception:
+                        logger.exception("Failed to apply deployment event")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Deployment event listener error: %s", e)
+            finally:
+                await pubsub.reset()
+                await redis.close()
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+    async def handle(self, event: Dict[str, Any]) -> Optional[dict]:
+        # Ties the API's logs for this event to the worker's for the task
+        token = correlation_id.set(event["task_id"])
+        try:
+            return await self._handle(event)
+        finally:
+            correlation_id.reset(token)
+
+    async def _handle(self, event: Dict[str, Any]) -> Optional[dict]:
+        async with AsyncSessionLocal() as db:
+            # Every API process receives the event; the row lock lets exactly
+            # one of them complete the deployment and broadcast it
+            deployment = await db.scalar(
+                select(models.Deployment)
+                .where(models.Deployment.task_id == event["task_id"])
+                .with_for_update()
+            )
+            # Unknown task, or already completed by another process or
+            # through the status endpoint
+            if deployment is None or deployment.status in TERMINAL_STATUSES:
+                return None
+            service = await db.get(models.Service, deployment.service_id)
+            message = apply_deployment_result(deployment, service, event["result"])
+            if message is None:
+                return None
+            await db.commit()
+
+        logger.info(
+            "Deployment %s of service %s finished: %s",
+            deployment.id,
+            deployment.service_id,
+            deployment.status.value,
+        )
+        await cache.bump([deployment.service_id])
+        await manager.broadcast(message)
+        return message
+
+    async def reconcile(self):
+        async with AsyncSessionLocal() as db:
+            task_ids = (
+                await db.scalars(
+                    select(models.Deployment.task_id).where(
+                        models.Deployment.status == models.DeploymentStatus.IN_PROGRESS,
+                        models.Deployment.task_id.is_not(None),
+                    )
+                )
+            ).all()
+
+        results = await asyncio.to_thread(fetch_task_results, task_ids)
+        for task_id, result in results.items():
+            await self.handle({"task_id": task_id, "result": result})
+
+
+deployment_listener = DeploymentEventListener()
@@ -0,0 +1,57 @@
+import os
+from typing import AsyncIterator, Dict
+
+import orjson
+from sqlalchemy import Select
+
+from . import models
+from .database import AsyncSessionLocal
+
+# Rows fetched from the server-side cursor, and sent as one chunk, at a time
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Exported fields by output key, named like the fields of the REST API's
+# responses
+SERVICE_FIELDS: Dict[str, object] = {
+    "id": models.Service.id,
+    "name": models.Service.name,
+    "url": models.Service.url,
+    "healthEndpoint": models.Service.healthEndpoint,
+    "response_format": models.Service.response_format,
+    "current_version": models.Service.current_version,
+    "schema": models.Service.database_schema,
+    "created_at": models.Service.created_at,
+    "last_check_at": models.Service.last_check_at,
+}
+DEPLOYMENT_FIELDS: Dict[str, object] = {
+    "id": models.Deployment.id,
+    "service_id": models.Deployment.service_id,
+    "version": models.Deployment.version,
+    "task_id": models.Deployment.task_id,
+    "status": models.Deployment.status,
+    "created_at": models.Deployment.created_at,
+    "completed_at": models.Deployment.completed_at,
+    "details": models.Deployment.details,
+}
+
+
+async def stream_ndjson(
+    stmt: Select, fields: Dict[str, object]
+) -> AsyncIterator[bytes]:
+    """
+    Yields the rows of stmt as newline-delimited JSON, one chunk per batch.
+    Rows are read from a server-side cursor EXPORT_BATCH_SIZE at a time, as
+    plain column tuples without building ORM objects, so memory stays flat
+    however many rows are exported.
+    """
+    keys = tuple(fields)
+    dumps = orjson.dumps
+    # Its own session: the stream outlives the request handler
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for rows in result.partitions():
+            yield b"".join(
+                dumps(dict(zip(keys, row)), option=orjson.OPT_APPEND_NEWLINE)
+                for row in rows
+            )
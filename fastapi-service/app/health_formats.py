@@ -0,0 +1,203 @@
+import re
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .models import ResponseFormat
+from .schemas import HealthResponse
+
+Parser = Callable[[dict], Optional[HealthResponse]]
+
+FORMAT_NAME = re.compile(r"^[a-z0-9][a-z0-9_\-]{0,49}$")
+PATH_SEGMENT = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+
+@dataclass(frozen=True)
+class FormatMapping:
+    """
+    Where a health payload keeps its platform, release and schema, as dotted
+    field paths (e.g. "service.database.schema_version"). release and schema
+    must be present for a payload to match; platform only if
+    platform_required is set, otherwise it is None when missing.
+    """
+
+    name: str
+    release: str
+    schema: str
+    platform: Optional[str] = None
+    platform_required: bool = False
+
+
+BUILTIN_FORMATS = (
+    FormatMapping(
+        ResponseFormat.STANDARD.value,
+        release="release",
+        schema="schema",
+        platform="platform",
+        platform_required=True,
+    ),
+    FormatMapping(
+        ResponseFormat.LIFEMOTE.value,
+        release="release",
+        schema="schema",
+        platform="platform",
+    ),
+    FormatMapping(ResponseFormat.SIMPLE.value, release="version", schema="db_version"),
+    FormatMapping(
+        ResponseFormat.DETAILED.value,
+        release="service.version",
+        schema="service.database.schema_version",
+        platform="service.platform_version",
+    ),
+    FormatMapping(
+        ResponseFormat.LEGACY.value,
+        release="app_version",
+        schema="db",
+        platform="runtime",
+    ),
+)
+
+
+# Raised by a field path that is missing from, or does not fit, a payload
+LOOKUP_ERRORS = (KeyError, TypeError, IndexError)
+
+
+def _getter(path: str) -> Callable[[dict], Any]:
+    segments = path.split(".")
+    if not all(PATH_SEGMENT.match(segment) for segment in segments):
+        raise ValueError(f"Invalid field path: {path!r}")
+    getters = [itemgetter(segment) for segment in segments]
+    if len(getters) == 1:
+        return getters[0]
+
+    def get(data):
+        for getter in getters:
+            data = getter(data)
+        return data
+
+    return get
+
+
+def compile_mapping(mapping: FormatMapping) -> Parser:
+    """
+    Builds a parser with every field path resolved to itemgetters up front,
+    so parsing a payload costs a few dict lookups and no path splitting.
+    Payloads missing a required path parse to None.
+    """
+    if not FORMAT_NAME.match(mapping.name):
+        raise ValueError(
+            f"Invalid format name: {mapping.name!r} (lowercase letters, digits, "
+            "'-' and '_', at most 50 characters)"
+        )
+    get_release = _getter(mapping.release)
+    get_schema = _getter(mapping.schema)
+    get_platform = _getter(mapping.platform) if mapping.platform else None
+    platform_required = get_platform is not None and mapping.platform_required
+    construct = HealthResponse.construct
+
+    def parse(data):
+        try:
+            release = get_release(data)
+            schema = get_schema(data)
+            platform = get_platform(data) if platform_required else None
+        except LOOKUP_ERRORS:
+            return None
+        if get_platform is not None and not platform_required:
+            try:
+                platform = get_platform(data)
+            except LOOKUP_ERRORS:
+                platform = None
+        # Plain strings are already valid, so the model is built without
+        # running validation; anything else (numbers to coerce, wrong types
+        # to reject) goes through the validating constructor
+        if (
+            release.__class__ is str
+            and schema.__class__ is str
+            and (platform is None or platform.__class__ is str)
+        ):
+            return construct(platform=platform, release=release, database_schema=schema)
+        return HealthResponse(platform=platform, release=release, schema=schema)
+
+    return parse
+
+
+class FormatRegistry:
+    """
+    Compiled parsers by format name. Formats are tried in registration order
+    when detecting the format of AUTO services, built-ins first.
+    """
+
+    def __init__(self, mappings: Iterable[FormatMapping] = ()):
+        self.mappings: Dict[str, FormatMapping] = {}
+        self.parsers: Dict[str, Parser] = {}
+        for mapping in mappings:
+            self.register(mapping)
+
+    def register(self, mapping: FormatMapping):
+        """
+        Compiles and adds a format, replacing any format of the same name.
+        Raises ValueError for an invalid name or field path.
+        """
+        if mapping.name == ResponseFormat.AUTO.value:
+            raise ValueError(f"{mapping.name!r} is reserved for format detection")
+        parser = compile_mapping(mapping)
+        self.mappings[mapping.name] = mapping
+        self.parsers[mapping.name] = parser
+
+    def unregister(self, name: str):
+        self.mappings.pop(name, None)
+        self.parsers.pop(name, None)
+
+    def get(self, name: str) -> Optional[Parser]:
+        # MySQL ENUM columns created before formats were declarative hold
+        # the upper-case names of the built-ins
+        return self.parsers.get(name) or self.parsers.get(name.lower())
+
+    def is_known(self, name: str) -> bool:
+        return name.lower() == ResponseFormat.AUTO.value or self.get(name) is not None
+
+
+BUILTIN_FORMAT_NAMES = frozenset(mapping.name for mapping in BUILTIN_FORMATS)
+
+format_registry = FormatRegistry(BUILTIN_FORMATS)
+
+
+def to_mapping(row: models.HealthFormat) -> FormatMapping:
+    return FormatMapping(
+        name=row.name,
+        release=row.release_path,
+        schema=row.schema_path,
+        platform=row.platform_path,
+        platform_required=row.platform_required,
+    )
+
+
+async def load_formats(db: AsyncSession) -> List[str]:
+    """
+    Registers the formats stored in the database that this process has not
+    compiled yet (registered through another API process, or before a
+    restart). Returns their names.
+    """
+    loaded = []
+    for row in await db.scalars(select(models.HealthFormat)):
+        mapping = to_mapping(row)
+        if format_registry.mappings.get(mapping.name) != mapping:
+            format_registry.register(mapping)
+            loaded.append(mapping.name)
+    return loaded
+
+
+async def ensure_formats(db: AsyncSession, names: Iterable[str]) -> List[str]:
+    """
+    Makes sure every named format is registered, reloading stored formats
+    if one is missing. Returns the names that are still unknown.
+    """
+    unknown = [name for name in set(names) if not format_registry.is_known(name)]
+    if unknown:
+        await load_formats(db)
+        unknown = [name for name in unknown if not format_registry.is_known(name)]
+    return unknown
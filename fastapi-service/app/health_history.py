@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, Optional
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+HEALTH_HISTORY_ENABLED = os.getenv("HEALTH_HISTORY_ENABLED", "true").lower() == "true"
+HEALTH_HISTORY_REDIS_URL = os.getenv(
+    "HEALTH_HISTORY_REDIS_URL", f"redis://{REDIS_HOST}:6379/2"
+)
+# Seconds each tier is kept
+HEALTH_HISTORY_RAW_RETENTION = int(os.getenv("HEALTH_HISTORY_RAW_RETENTION", "21600"))
+HEALTH_HISTORY_MINUTE_RETENTION = int(
+    os.getenv("HEALTH_HISTORY_MINUTE_RETENTION", "172800")
+)
+HEALTH_HISTORY_HOUR_RETENTION = int(
+    os.getenv("HEALTH_HISTORY_HOUR_RETENTION", "7776000")
+)
+# Largest number of rollup buckets a single query reads; above the buckets
+# the default 1m (2880) and 1h (2160) retention keep, so the whole of either
+# tier fits in one query
+MAX_HISTORY_BUCKETS = 3000
+
+
+class Resolution(str, Enum):
+    RAW = "raw"
+    MINUTE = "1m"
+    HOUR = "1h"
+
+
+BUCKET_SECONDS = {Resolution.MINUTE: 60, Resolution.HOUR: 3600}
+# Seconds of buckets kept together in one hash: a day of minutes, 30 days of
+# hours
+PERIOD_SECONDS = {Resolution.MINUTE: 86400, Resolution.HOUR: 30 * 86400}
+# Fields of one bucket, stored in its period's hash as "<bucket>:<field>"
+BUCKET_FIELDS = (
+    "checks",
+    "failures",
+    "timed",
+    "latency_ms_sum",
+    "first_release",
+    "release",
+    "first_schema",
+    "schema",
+)
+
+
+@dataclass
+class HealthSample:
+    service_id: int
+    timestamp: float
+    ok: bool
+    # None when no response was received
+    status_code: Optional[int] = None
+    latency_ms: Optional[float] = None
+    release: Optional[str] = None
+    database_schema: Optional[str] = None
+
+
+class HealthHistory:
+    """
+    Time series of health check outcomes, kept in Redis in three tiers:
+
+    - raw: every check, as a compact JSON array in a per-service sorted set
+      scored by timestamp
+    - 1m / 1h: one hash per service and period (PERIOD_SECONDS), holding
+      the fields of each of its buckets, updated in place with HINCRBY
+      (checks, failures, latency sum) plus the first and last release/schema
+      seen in the bucket
+
+    A service has a handful of keys per tier, each expiring as a whole once
+    its period is past retention, so nothing needs compacting; a range query
+    reads at most MAX_HISTORY_BUCKETS buckets with one HMGET per period, in
+    one pipeline.
+    """
+
+    def __init__(
+        self,
+        url: str = HEALTH_HISTORY_REDIS_URL,
+        enabled: bool = HEALTH_HISTORY_ENABLED,
+        retention: Optional[Dict[Resolution, int]] = None,
+    ):
+        self.url = url
+        self.enabled = enabled
+        self.retention = retention or {
+            Resolution.RAW: HEALTH_HISTORY_RAW_RETENTION,
+            Resolution.MINUTE: HEALTH_HISTORY_MINUTE_RETENTION,
+            Resolution.HOUR: HEALTH_HISTORY_HOUR_RETENTION,
+        }
+        self.redis: Optional[aioredis.Redis] = None
+        self.recorded = 0
+        self.errors = 0
+
+    def get_redis(self) -> aioredis.Redis:
+        if self.redis is None:
+            self.redis = aioredis.from_url(
+                self.url, socket_connect_timeout=1, socket_timeout=1
+            )
+        return self.redis
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    @staticmethod
+    def _raw_key(service_id: int) -> str:
+        return f"health:raw:{service_id}"
+
+    @staticmethod
+    def _period(resolution: Resolution, bucket: int) -> int:
+        return bucket // PERIOD_SECONDS[resolution]
+
+    @staticmethod
+    def _period_key(service_id: int, resolution: Resolution, period: int) -> str:
+        return f"health:{resolution.value}:{service_id}:{period}"
+
+    async def record(self, samples: List[HealthSample]):
+        """
+        Appends the samples of one sweep, in a single pipeline
+        """
+        if not self.enabled or not samples:
+            return
+        try:
+            async with self.get_redis().pipeline(transaction=False) as pipe:
+                for sample in samples:
+                    self._record(pipe, sample)
+                await pipe.execute()
+        except RedisError as e:
+            self.errors += 1
+            logger.warning("Health history write failed: %s", e)
+            return
+        self.recorded += len(samples)
+
+    def _record(self, pipe, sample: HealthSample):
+        raw_key = self._raw_key(sample.service_id)
+        raw_retention = self.retention[Resolution.RAW]
+        member = json.dumps(
+            [
+                round(sample.timestamp, 3),
+                int(sample.ok),
+                sample.status_code,
+                None if sample.latency_ms is None else round(sample.latency_ms, 1),
+                sample.release,
+                sample.database_schema,
+            ],
+            separators=(",", ":"),
+        )
+        pipe.zadd(raw_key, {member: sample.timestamp})
+        pipe.zremrangebyscore(raw_key, "-inf", sample.timestamp - raw_retention)
+        pipe.expire(raw_key, raw_retention)
+
+        for resolution, size in BUCKET_SECONDS.items():
+            bucket = int(sample.timestamp // size * size)
+            period = self._period(resolution, bucket)
+            key = self._period_key(sample.service_id, resolution, period)
+            prefix = f"{bucket}:"
+            pipe.hincrby(key, prefix + "checks", 1)
+            if not sample.ok:
+                pipe.hincrby(key, prefix + "failures", 1)
+            if sample.latency_ms is not None:
+                pipe.hincrby(key, prefix + "timed", 1)
+                pipe.hincrbyfloat(key, prefix + "latency_ms_sum", sample.latency_ms)
+            if sample.release is not None:
+                pipe.hsetnx(key, prefix + "first_release", sample.release)
+                pipe.hset(key, prefix + "release", sample.release)
+            if sample.database_schema is not None:
+                pipe.hsetnx(key, prefix + "first_schema", sample.database_schema)
+                pipe.hset(key, prefix + "schema", sample.database_schema)
+            # Kept until the period's last bucket is past retention
+            period_end = (period + 1) * PERIOD_SECONDS[resolution]
+            pipe.expireat(key, period_end + self.retention[resolution])
+
+    def clamp_start(self, start: float, end: float, resolution: Resolution) -> float:
+        """
+        The start a query reads from: no earlier than the resolution's
+        retention, before which there is nothing to read, and at most
+        MAX_HISTORY_BUCKETS buckets before end
+        """
+        earliest = time.time() - self.retention[resolution]
+        if resolution != Resolution.RAW:
+            size = BUCKET_SECONDS[resolution]
+            earliest = max(
+                earliest, (int(end) // size - MAX_HISTORY_BUCKETS + 1) * size
+            )
+        return max(start, earliest)
+
+    async def query(
+        self, service_id: int, start: float, end: float, resolution: Resolution
+    ) -> List[dict]:
+        """
+        Points of one service between start and end (UNIX timestamps), the
+        start clamped by clamp_start
+        """
+        start = self.clamp_start(start, end, resolution)
+        if resolution == Resolution.RAW:
+            members = await self.get_redis().zrangebyscore(
+                self._raw_key(service_id), start, end
+            )
+            return [self._raw_point(member) for member in members]
+
+        size = BUCKET_SECONDS[resolution]
+        periods: Dict[int, List[int]] = {}
+        for bucket in range(int(start // size * size), int(end) + 1, size):
+            periods.setdefault(self._period(resolution, bucket), []).append(bucket)
+        async with self.get_redis().pipeline(transaction=False) as pipe:
+            for period, buckets in periods.items():
+                pipe.hmget(
+                    self._period_key(service_id, resolution, period),
+                    [
+                        f"{bucket}:{field}"
+                        for bucket in buckets
+                        for field in BUCKET_FIELDS
+                    ],
+                )
+            replies = await pipe.execute()
+
+        points = []
+        width = len(BUCKET_FIELDS)
+        for buckets, values in zip(periods.values(), replies):
+            for index, bucket in enumerate(buckets):
+                entry = values[index * width : (index + 1) * width]
+                # Every bucket that saw a check has a checks field
+                if entry[0] is not None:
+                    points.append(self._bucket_point(bucket, entry))
+        return points
+
+    @staticmethod
+    def _raw_point(member: bytes) -> dict:
+        timestamp, ok, status_code, latency_ms, release, schema = json.loads(member)
+        return {
+            "timestamp": timestamp,
+            "checks": 1,
+            "failures": 0 if ok else 1,
+            "status_code": status_code,
+            "avg_latency_ms": latency_ms,
+            "release": release,
+            "database_schema": schema,
+        }
+
+    @staticmethod
+    def _bucket_point(bucket: int, entry: List[Optional[bytes]]) -> dict:
+        fields = {
+            field: value.decode()
+            for field, value in zip(BUCKET_FIELDS, entry)
+            if value is not None
+        }
+        timed = int(fields.get("timed", 0))
+        release = fields.get("release")
+        schema = fields.get("schema")
+        return {
+            "timestamp": bucket,
+            "checks": int(fields.get("checks", 0)),
+            "failures": int(fields.get("failures", 0)),
+            "avg_latency_ms": (
+                float(fields["latency_ms_sum"]) / timed if timed else None
+            ),
+            "release": release,
+            "database_schema": schema,
+            "release_changed": fields.get("first_release", release) != release,
+            "schema_changed": fields.get("first_schema", schema) != schema,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        return {"recorded": self.recorded, "errors": self.errors}
+
+
+health_history = HealthHistory()
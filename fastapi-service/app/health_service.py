@@ -1,113 +1,255 @@
-from typing import Any, Dict, Optional
+import hashlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Optional, Tuple
 
 import httpx
 
+from .health_formats import format_registry
+from .metrics import format_detections, format_parse_attempts, record_health_check
 from .models import ResponseFormat
 from .schemas import HealthResponse
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HealthValidators:
+    """
+    Cache validators remembered from the last successful health fetch of a service
+    """
+
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    body_hash: Optional[str] = None
+
+    def request_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+@dataclass
+class HealthFetchResult:
+    validators: HealthValidators
+    not_modified: bool = False
+    health: Optional[HealthResponse] = None
+    # Format that parsed the payload (the detected one for AUTO services)
+    format: Optional[str] = None
+    status_code: Optional[int] = None
+    latency_ms: Optional[float] = None
+
+
+class FormatDetector:
+    """
+    Detects the response format of AUTO services. Payloads are fingerprinted by
+    their top-level key set and the parser that matched a fingerprint is cached,
+    so repeated checks of the same service shape dispatch directly.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._cache: Dict[FrozenSet[str], str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(data: Dict[str, Any]) -> FrozenSet[str]:
+        return frozenset(data)
+
+    def detect_and_parse(
+        self, data: Dict[str, Any]
+    ) -> Tuple[Optional[str], Optional[HealthResponse]]:
+        if not isinstance(data, dict):
+            return None, None
+
+        fingerprint = self.fingerprint(data)
+        cached_format = self._cache.get(fingerprint)
+        if cached_format is not None:
+            result = self._try_parse(cached_format, data)
+            if result:
+                self.hits += 1
+                format_detections[("cache_hit",)].inc()
+                return cached_format, result
+            # Same keys but nested values no longer match - detect again
+            del self._cache[fingerprint]
+
+        self.misses += 1
+        # Snapshot: formats may be registered while detecting
+        for format in list(format_registry.parsers):
+            result = self._try_parse(format, data)
+            format_parse_attempts[(format, "matched" if result else "failed")].inc()
+            if result:
+                if len(self._cache) >= self.max_entries:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[fingerprint] = format
+                format_detections[("detected",)].inc()
+                return format, result
+
+        format_detections[("undetected",)].inc()
+        return None, None
+
+    @staticmethod
+    def _try_parse(format: str, data: Dict[str, Any]) -> Optional[HealthResponse]:
+        try:
+            return format_registry.parsers[format](data)
+        except (KeyError, TypeError, AttributeError, ValueError):
+            # Payload does not have the shape this parser expects
+            return None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._cache),
+        }
+
 
 class HealthCheckService:
     @staticmethod
     def parse_response(data: Dict[str, Any], format: str) -> Optional[HealthResponse]:
+        return HealthCheckService.parse_response_with_format(data, format)[1]
+
+    @staticmethod
+    def parse_response_with_format(
+        data: Dict[str, Any], format: str
+    ) -> Tuple[Optional[str], Optional[HealthResponse]]:
+        """
+        Parses a health payload and also returns the format that matched it
+        """
+        format = format.lower()
         try:
             if format == ResponseFormat.AUTO.value:
-                return HealthCheckService._auto_detect_and_parse(data)
+                return format_detector.detect_and_parse(data)
 
-            parser = getattr(HealthCheckService, f"_parse_{format}", None)
+            parser = format_registry.get(format)
             if parser:
                 result = parser(data)
-                print(
-                    f"Parsed result: {result.dict() if result else None}"
-                )  # Debug log
-                return result
+                logger.debug("Parsed result: %r", result)
+                return (format if result else None), result
 
-            return None
+            return None, None
         except Exception as e:
-            print(f"Parse error: {str(e)}")
-            return None
+            logger.warning("Parse error for format %s: %s", format, e)
+            return None, None
 
     @staticmethod
-    def _auto_detect_and_parse(data: Dict[str, Any]) -> Optional[HealthResponse]:
-        # Try all parsers until one works
-        for format in ResponseFormat:
-            if format == ResponseFormat.AUTO:
-                continue
-
-            parser = getattr(HealthCheckService, f"_parse_{format.value}", None)
-            if parser:
-                try:
-                    result = parser(data)
-                    if result:
-                        print(f"Auto-detected format: {format.value}")
-                        return result
-                except Exception as e:
-                    print(f"Parser {format.value} failed: {str(e)}")
-                    continue
-
-        return None
+    def stored_format(
+        configured: Optional[str], detected: Optional[str]
+    ) -> Optional[str]:
+        """
+        The response format to store for a service whose payload was parsed
+        with `detected`: the detected format while the service is AUTO, so
+        later checks dispatch directly, otherwise the configured one
+        """
+        if (
+            detected
+            and (configured or ResponseFormat.AUTO.value).lower()
+            == ResponseFormat.AUTO.value
+        ):
+            return detected
+        return configured
 
     @staticmethod
-    def _parse_standard(data: Dict[str, Any]) -> Optional[HealthResponse]:
-        if all(key in data for key in ["platform", "release", "schema"]):
-            return HealthResponse(
-                platform=data["platform"],
-                release=data["release"],
-                schema=data["schema"],
+    async def fetch_health(
+        client: httpx.AsyncClient,
+        url: str,
+        format: str,
+        validators: Optional[HealthValidators] = None,
+    ) -> Optional[HealthFetchResult]:
+        """
+        Conditional health fetch. A 304 or a body identical to the previous one
+        is reported as not_modified without being parsed. Returns None if the
+        request itself fails; error statuses and unparseable bodies are
+        returned with health=None.
+        """
+        headers = validators.request_headers() if validators else {}
+        started = time.perf_counter()
+        try:
+            response = await client.get(url, headers=headers)
+        except Exception as e:
+            logger.warning(
+                "Health check failed for %s: %s",
+                url,
+                e,
+                extra={"sample": "health_check_failed"},
             )
-        return None
-
-    @staticmethod
-    def _parse_lifemote(data: Dict[str, Any]) -> Optional[HealthResponse]:
-        if "release" in data and "schema" in data:
-            return HealthResponse(
-                platform=data.get("platform"),
-                release=data["release"],
-                schema=data["schema"],
+            record_health_check(format, "unreachable", None)
+            return None
+        latency_ms = (time.perf_counter() - started) * 1000
+        if response.status_code == 304 and validators:
+            record_health_check(format, "not_modified", latency_ms)
+            return HealthFetchResult(
+                validators=validators,
+                not_modified=True,
+                status_code=response.status_code,
+                latency_ms=latency_ms,
+            )
+        failed = HealthFetchResult(
+            validators=HealthValidators(),
+            status_code=response.status_code,
+            latency_ms=latency_ms,
+        )
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            logger.warning(
+                "Health check failed for %s: %s",
+                url,
+                e,
+                extra={"sample": "health_check_failed"},
             )
-        return None
+            record_health_check(format, "http_error", latency_ms)
+            return failed
 
-    @staticmethod
-    def _parse_simple(data: Dict[str, Any]) -> Optional[HealthResponse]:
-        if "version" in data and "db_version" in data:
-            return HealthResponse(
-                platform=None, release=data["version"], schema=data["db_version"]
+        new_validators = HealthValidators(
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            body_hash=hashlib.blake2b(response.content, digest_size=16).hexdigest(),
+        )
+        if validators and validators.body_hash == new_validators.body_hash:
+            record_health_check(format, "not_modified", latency_ms)
+            return HealthFetchResult(
+                validators=new_validators,
+                not_modified=True,
+                status_code=response.status_code,
+                latency_ms=latency_ms,
             )
-        return None
 
-    @staticmethod
-    def _parse_detailed(data: Dict[str, Any]) -> Optional[HealthResponse]:
         try:
-            service = data.get("service", {})
-            return HealthResponse(
-                platform=service.get("platform_version"),
-                release=service["version"],
-                schema=service["database"]["schema_version"],
+            data = response.json()
+        except ValueError as e:
+            logger.warning(
+                "Health check failed for %s: %s",
+                url,
+                e,
+                extra={"sample": "health_check_failed"},
             )
-        except KeyError:
-            return None
-
-    @staticmethod
-    def _parse_legacy(data: Dict[str, Any]) -> Optional[HealthResponse]:
-        if "app_version" in data and "db" in data:
-            return HealthResponse(
-                platform=data.get("runtime"),
-                release=data["app_version"],
-                schema=data["db"],
+            record_health_check(format, "invalid", latency_ms)
+            return failed
+        detected_format, health = HealthCheckService.parse_response_with_format(
+            data, format
+        )
+        record_health_check(
+            detected_format or format, "ok" if health else "invalid", latency_ms
+        )
+        if health:
+            logger.info(
+                "Health check succeeded for %s",
+                url,
+                extra={"sample": "health_check_ok", "latency_ms": round(latency_ms, 1)},
             )
-        return None
+        return HealthFetchResult(
+            validators=new_validators,
+            health=health,
+            format=detected_format,
+            status_code=response.status_code,
+            latency_ms=latency_ms,
+        )
 
-    @staticmethod
-    async def check_service_health(url: str, format: str) -> Optional[HealthResponse]:
-        try:
-            print(f"Checking health for URL: {url} with format: {format}")
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=5.0)
-                response.raise_for_status()
-                data = response.json()
-                print(f"Received response: {data}")
-                result = HealthCheckService.parse_response(data, format)
-                print(f"Final parsed result: {result.dict() if result else None}")
-                return result
-        except Exception as e:
-            print(f"Health check failed for {url}: {str(e)}")
-            return None
+
+format_detector = FormatDetector()
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError, WatchError
+
+from .celery_app import CELERY_REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+LEADER_ELECTION_ENABLED = os.getenv("LEADER_ELECTION_ENABLED", "true").lower() == "true"
+# Seconds a lease lasts without renewal; the holder renews it every third
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))
+LEADER_LEASE_KEY = "leader:background-jobs"
+
+
+class LeaderLease:
+    """
+    Redis lease electing the one API process that runs the jobs which must
+    run once per deployment, not once per replica (health sweeps, deployment
+    events, archival). Acquired with SET NX PX and renewed by its holder; a
+    holder that cannot renew steps down before the lease can have expired,
+    and another process takes over within one ttl of it stopping.
+    """
+
+    def __init__(
+        self,
+        on_elected: Callable[[], Awaitable[None]],
+        on_deposed: Callable[[], Awaitable[None]],
+        url: str = CELERY_REDIS_URL,
+        key: str = LEADER_LEASE_KEY,
+        ttl: float = LEADER_LEASE_TTL,
+        enabled: bool = LEADER_ELECTION_ENABLED,
+    ):
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.url = url
+        self.key = key
+        self.ttl = ttl
+        self.enabled = enabled
+        self.token = uuid4().hex
+        self.redis: Optional[aioredis.Redis] = None
+        self.is_leader = False
+        self._renewed_at = float("-inf")
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            await self._step_down()
+            if self.enabled:
+                try:
+                    # Hand over now instead of after the ttl
+                    await self._release()
+                except RedisError as e:
+                    logger.warning("Failed to release leader lease: %s", e)
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    def get_redis(self) -> aioredis.Redis:
+        if self.redis is None:
+            self.redis = aioredis.from_url(
+                self.url, socket_connect_timeout=1, socket_timeout=1
+            )
+        return self.redis
+
+    async def run(self):
+        if not self.enabled:
+            # Single-process deployments: always the leader
+            await self._become_leader()
+            return
+        while True:
+            try:
+                if self.is_leader:
+                    held = await self._renew()
+                else:
+                    held = await self.get_redis().set(
+                        self.key, self.token, nx=True, px=int(self.ttl * 1000)
+                    )
+                if held:
+                    self._renewed_at = time.monotonic()
+            except RedisError as e:
+                logger.warning("Leader lease check failed: %s", e)
+                held = self.is_leader and (
+                    time.monotonic() - self._renewed_at < self.ttl * 2 / 3
+                )
+            if held and not self.is_leader:
+                await self._become_leader()
+            elif not held and self.is_leader:
+                await self._step_down()
+            await asyncio.sleep(self.ttl / 3)
+
+    async def _become_leader(self):
+        logger.info("Elected leader, starting background jobs")
+        self.is_leader = True
+        await self.on_elected()
+
+    async def _step_down(self):
+        logger.info("Lost leadership, stopping background jobs")
+        self.is_leader = False
+        await self.on_deposed()
+
+    async def _renew(self) -> bool:
+        # Extends the lease only if it is still ours
+        async with self.get_redis().pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self.key)
+                if (await pipe.get(self.key) or b"").decode() != self.token:
+                    return False
+                pipe.multi()
+                pipe.pexpire(self.key, int(self.ttl * 1000))
+                await pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    async def _release(self):
+        async with self.get_redis().pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(self.key)
+                if (await pipe.get(self.key) or b"").decode() != self.token:
+                    return
+                pipe.multi()
+                pipe.delete(self.key)
+                await pipe.execute()
+            except WatchError:
+                pass
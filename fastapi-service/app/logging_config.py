@@ -0,0 +1,233 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-logger levels, e.g. "app.health_service=DEBUG,app.cache=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Records logged with extra={"sample": key}: the first LOG_SAMPLE_BURST per
+# key and LOG_SAMPLE_INTERVAL seconds are kept, then one in LOG_SAMPLE_RATE
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "10"))
+LOG_SAMPLE_INTERVAL = float(os.getenv("LOG_SAMPLE_INTERVAL", "60"))
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", "100"))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Libraries that log every request at INFO; LOG_LEVELS can override these
+DEFAULT_LOGGER_LEVELS = {"httpx": "WARNING"}
+
+# Correlation ID of the request, deployment task or sweep being handled
+correlation_id: ContextVar[str] = ContextVar("correlation_id", default="-")
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_correlation_id() -> str:
+    return uuid4().hex
+
+
+class CorrelationIdFilter(logging.Filter):
+    """
+    Stamps records with the current correlation ID. Runs on the thread that
+    logged the record, before it is handed to the queue.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Rate-limits repetitive records, identified by extra={"sample": key}. Per
+    key and interval, the first `burst` records pass and after that one in
+    `rate`; each passing record carries how many were suppressed before it.
+    Records without a sample key always pass.
+    """
+
+    def __init__(
+        self,
+        burst: int = LOG_SAMPLE_BURST,
+        interval: float = LOG_SAMPLE_INTERVAL,
+        rate: int = LOG_SAMPLE_RATE,
+    ):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.rate = max(1, rate)
+        # key -> (window start, records seen in the window, suppressed)
+        self._windows: Dict[str, Tuple[float, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            started, seen, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.interval:
+                started, seen = now, 0
+            seen += 1
+            keep = seen <= self.burst or random.randrange(self.rate) == 0
+            self._windows[key] = (started, seen, 0 if keep else suppressed + 1)
+        if keep and suppressed:
+            record.suppressed = suppressed
+        return keep
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Formatted by RecordQueueHandler before the record was queued
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues a copy of each record with its message merged and its traceback
+    rendered to exc_text, without running the output formatter: the stock
+    QueueHandler formats the whole record on the logging thread and folds
+    the traceback into the message, losing the JSON "exception" field.
+    """
+
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            # Tracebacks hold frames alive, so they are rendered now
+            if not record.exc_text:
+                record.exc_text = self._exception_formatter.formatException(
+                    record.exc_info
+                )
+            record.exc_info = None
+        return record
+
+
+def setup_logging():
+    """
+    Routes all logging through a queue: callers only enqueue the record and
+    a listener thread formats and writes it, so log I/O never blocks the
+    event loop. Safe to call more than once.
+    """
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(
+            logging.Formatter(
+                "%(asctime)s %(levelname)s %(name)s [%(correlation_id)s] %(message)s"
+            )
+        )
+
+    handler = RecordQueueHandler(queue.SimpleQueue())
+    handler.addFilter(CorrelationIdFilter())
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    levels = dict(DEFAULT_LOGGER_LEVELS)
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    _start_listener(handler, output)
+    # Threads do not survive fork: a forked child (e.g. a Celery prefork
+    # worker) would enqueue records that nothing ever writes
+    os.register_at_fork(after_in_child=lambda: _start_listener(handler, output))
+    atexit.register(stop_logging)
+
+
+def _start_listener(handler: RecordQueueHandler, output: logging.Handler):
+    global _listener
+    # A fresh queue, as a fork may have copied the old one mid-operation
+    handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(handler.queue, output)
+    _listener.start()
+
+
+def stop_logging():
+    """
+    Writes the records still queued and stops the listener thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class CorrelationIdMiddleware:
+    """
+    ASGI middleware giving every HTTP request and WebSocket connection a
+    correlation ID: the client's X-Request-ID if it sent one, a new one
+    otherwise. HTTP responses echo it back.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        header = REQUEST_ID_HEADER.lower().encode()
+        request_id = (
+            next(
+                (value.decode() for name, value in scope["headers"] if name == header),
+                None,
+            )
+            or new_correlation_id()
+        )
+        token = correlation_id.set(request_id[:64])
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (header, correlation_id.get().encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            correlation_id.reset(token)
@@ -1,5 +1,12 @@
-from datetime import datetime
-from typing import List
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
 
 import httpx
 from fastapi import (
@@ -7,20 +14,123 @@ from fastapi import (
     Depends,
     FastAPI,
     HTTPException,
+    Query,
+    Request,
+    Response,
     WebSocket,
     WebSocketDisconnect,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST
+from redis.exceptions import RedisError
+from sqlalchemy import and_, or_, select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
 from . import models, schemas
-from .celery_app import celery_app, deploy_service
-from .database import get_db
-from .health_service import HealthCheckService
-from .websocket import manager
-
-app = FastAPI()
+from .archive import ARCHIVE_ENABLED, archiver
+from .auth.cache import stop_jwks_caches
+from .cache import cache
+from .celery_app import celery_app
+from .database import (
+    AsyncSessionLocal,
+    dispose_engines,
+    get_async_db,
+    get_db,
+    init_database,
+)
+from .deployment_events import (
+    DEPLOYMENT_EVENTS_ENABLED,
+    complete_finished_deployments,
+    deployment_listener,
+    deployment_started_event,
+    start_deployments,
+)
+from .export import (
+    DEPLOYMENT_FIELDS,
+    NDJSON_MEDIA_TYPE,
+    SERVICE_FIELDS,
+    stream_ndjson,
+)
+from .health_formats import (
+    BUILTIN_FORMAT_NAMES,
+    FormatMapping,
+    ensure_formats,
+    format_registry,
+    load_formats,
+)
+from .health_history import Resolution, health_history
+from .health_service import HealthCheckService, HealthFetchResult, format_detector
+from .leader import LeaderLease
+from .logging_config import CorrelationIdMiddleware, setup_logging
+from .metrics import PrometheusMiddleware, render_metrics
+from .poller import HEALTH_POLL_ENABLED, poller
+from .readiness import readiness
+from .rollout import orchestrator
+from .websocket import ALL_TOPIC, manager, service_topic
+
+# Maximum concurrent health checks while validating a bulk registration
+BULK_HEALTH_CHECK_CONCURRENCY = int(os.getenv("BULK_HEALTH_CHECK_CONCURRENCY", "20"))
+# Page sizes for keyset-paginated listings
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Response header carrying the `after_id` of the next page, if there is one
+NEXT_PAGE_HEADER = "X-Next-After-Id"
+# Response header carrying the `cursor` of the next deployment history page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+async def startup():
+    """
+    Everything that needs the database; run in the background by readiness
+    so the process serves /health/live while waiting for it
+    """
+    await init_database()
+    async with AsyncSessionLocal() as db:
+        await load_formats(db)
+    leader.start()
+
+
+async def start_background_jobs():
+    if HEALTH_POLL_ENABLED:
+        poller.start()
+    if DEPLOYMENT_EVENTS_ENABLED:
+        deployment_listener.start()
+    if ARCHIVE_ENABLED:
+        archiver.start()
+
+
+async def stop_background_jobs():
+    await poller.stop()
+    await deployment_listener.stop()
+    await archiver.stop()
+
+
+# Only one API process runs the background jobs, however many replicas there are
+leader = LeaderLease(start_background_jobs, stop_background_jobs)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    manager.start()
+    readiness.start(startup)
+    yield
+    await readiness.stop()
+    await leader.stop()
+    await orchestrator.stop()
+    await stop_jwks_caches()
+    await manager.stop()
+    await cache.close()
+    await health_history.close()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS ayarları
 app.add_middleware(
@@ -29,50 +139,92 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_PAGE_HEADER, NEXT_CURSOR_HEADER],
 )
+app.add_middleware(PrometheusMiddleware)
+app.add_middleware(CorrelationIdMiddleware)
 
 
-# WebSocket endpoints
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, topics: Optional[str] = None):
+    # Without ?topics= a connection receives every event until it unsubscribes
+    # from "*"; clients change their topics with subscribe/unsubscribe messages
+    await manager.connect(websocket, topics.split(",") if topics else [ALL_TOPIC])
     try:
         while True:
-            data = await websocket.receive_text()
-            await websocket.send_text(f"Message text was: {data}")
+            manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
 
 @app.websocket("/ws/service/{service_id}")
 async def service_websocket_endpoint(websocket: WebSocket, service_id: int):
-    await manager.connect(websocket, service_id)
+    await manager.connect(websocket, [service_topic(service_id)])
     try:
         while True:
-            data = await websocket.receive_text()
-            await manager.send_service_update(
-                service_id,
-                {"type": "service_update", "service_id": service_id, "data": data},
-            )
+            manager.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
-        manager.disconnect(websocket, service_id)
+        manager.disconnect(websocket)
+
+
+def normalize_base_url(service: schemas.ServiceCreate) -> str:
+    # Remove endpoint from base URL if it's already included
+    base_url = service.url
+    if service.healthEndpoint in base_url:
+        base_url = base_url.replace(service.healthEndpoint, "")
+    base_url = base_url.rstrip("/")
+
+    # Handle Docker network URLs
+    if "localhost:5000" in base_url:
+        base_url = base_url.replace("localhost:5000", "mock-service:5000")
+
+    return base_url
+
+
+def keyset_select(stmt, model, after_id: Optional[int], limit: int):
+    """
+    Keyset pagination on the primary key. One extra row is selected so that
+    split_page can tell whether another page exists.
+    """
+    if after_id is not None:
+        stmt = stmt.where(model.id > after_id)
+    return stmt.order_by(model.id).limit(limit + 1)
+
+
+def split_page(rows: list, limit: int) -> Tuple[list, dict]:
+    """
+    Returns the page and the NEXT_PAGE_HEADER pointing at the following one
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, {NEXT_PAGE_HEADER: str(rows[-1].id)}
+    return rows, {}
+
+
+def service_event_payload(db_service: models.Service) -> dict:
+    return {
+        "id": db_service.id,
+        "name": db_service.name,
+        "url": db_service.url,
+        "current_version": db_service.current_version,
+        "database_schema": db_service.database_schema,
+    }
 
 
 # REST API endpoints
 @app.post("/services/", response_model=schemas.Service)
-async def create_service(service: schemas.ServiceCreate, db: Session = Depends(get_db)):
+async def create_service(
+    service: schemas.ServiceCreate, db: AsyncSession = Depends(get_async_db)
+):
     try:
-        print(f"Received service creation request: {service.dict()}")
-
-        # Remove endpoint from base URL if it's already included
-        base_url = service.url
-        if service.healthEndpoint in base_url:
-            base_url = base_url.replace(service.healthEndpoint, "")
-        base_url = base_url.rstrip("/")
+        logger.debug("Received service creation request: %r", service)
+        if await ensure_formats(db, [service.response_format]):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown response format: {service.response_format}",
+            )
 
-        # Handle Docker network URLs
-        if "localhost:5000" in base_url:
-            base_url = base_url.replace("localhost:5000", "mock-service:5000")
+        base_url = normalize_base_url(service)
 
         # Create service with corrected URL
         db_service = models.Service(
@@ -80,15 +232,17 @@ async def create_service(service: schemas.ServiceCreate, db: Session = Depends(g
             url=base_url,
             healthEndpoint=service.healthEndpoint,
             response_format=service.response_format,
+            deployments=[],
         )
 
         # Construct full URL for health check
         full_url = f"{base_url}{service.healthEndpoint}"
-        print(f"Attempting health check at URL: {full_url}")
+        logger.debug("Attempting health check at URL: %s", full_url)
 
-        health_info = await HealthCheckService.check_service_health(
-            full_url, service.response_format
+        result = await HealthCheckService.fetch_health(
+            poller.get_client(), full_url, service.response_format
         )
+        health_info = result.health if result else None
 
         if not health_info:
             raise HTTPException(
@@ -96,61 +250,278 @@ async def create_service(service: schemas.ServiceCreate, db: Session = Depends(g
                 detail="Could not retrieve service information. Please check the URL and response format.",
             )
 
-        print(f"Health check response: {health_info.dict()}")
+        logger.debug("Health check response: %r", health_info)
 
-        # Access schema value correctly
+        db_service.response_format = HealthCheckService.stored_format(
+            service.response_format, result.format
+        )
         db_service.current_version = health_info.release
-        db_service.database_schema = (
-            health_info.schema
-        )  # Using the alias defined in HealthResponse
+        # `schema` is only the alias; the attribute is BaseModel.schema()
+        db_service.database_schema = health_info.database_schema
         db_service.last_check_at = datetime.utcnow()
 
     except HTTPException as he:
-        print(f"HTTP Exception during service creation: {str(he)}")
+        logger.info("Service creation rejected: %s", he.detail)
         raise he
     except Exception as e:
-        print(f"Unexpected error during service creation: {str(e)}")
+        logger.exception("Unexpected error during service creation")
         raise HTTPException(
             status_code=400, detail=f"Service creation failed: {str(e)}"
         )
 
     try:
         db.add(db_service)
-        db.commit()
-        db.refresh(db_service)
+        await db.commit()
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=400, detail="Service with this name already exists"
         )
 
+    await cache.bump([db_service.id])
     await manager.broadcast(
-        {
-            "type": "service_created",
-            "service": {
-                "id": db_service.id,
-                "name": db_service.name,
-                "url": db_service.url,
-                "current_version": db_service.current_version,
-                "database_schema": db_service.database_schema,
-            },
-        }
+        {"type": "service_created", "service": service_event_payload(db_service)}
     )
 
     return db_service
 
 
+@app.post("/services/bulk", response_model=List[schemas.ServiceBulkResult])
+async def create_services_bulk(
+    services: List[schemas.ServiceCreate], db: AsyncSession = Depends(get_async_db)
+):
+    results: List[Optional[schemas.ServiceBulkResult]] = [None] * len(services)
+
+    def fail(index: int, error: str):
+        results[index] = schemas.ServiceBulkResult(
+            index=index, name=services[index].name, success=False, error=error
+        )
+
+    # Reject duplicates (existing rows or repeated within the batch) before
+    # spending a health check on them
+    names = {service.name for service in services}
+    taken = set(
+        await db.scalars(
+            select(models.Service.name).where(models.Service.name.in_(names))
+        )
+    )
+    unknown_formats = set(
+        await ensure_formats(db, {service.response_format for service in services})
+    )
+    candidates: List[int] = []
+    for index, service in enumerate(services):
+        if service.name in taken:
+            fail(index, "Service with this name already exists")
+        elif service.response_format in unknown_formats:
+            fail(index, f"Unknown response format: {service.response_format}")
+        else:
+            taken.add(service.name)
+            candidates.append(index)
+
+    semaphore = asyncio.Semaphore(BULK_HEALTH_CHECK_CONCURRENCY)
+    client = poller.get_client()
+
+    async def check(index: int) -> Tuple[str, Optional[HealthFetchResult]]:
+        service = services[index]
+        base_url = normalize_base_url(service)
+        async with semaphore:
+            result = await HealthCheckService.fetch_health(
+                client, f"{base_url}{service.healthEndpoint}", service.response_format
+            )
+        return base_url, result
+
+    checks = dict(
+        zip(candidates, await asyncio.gather(*(check(index) for index in candidates)))
+    )
+    valid: List[int] = []
+    for index in candidates:
+        result = checks[index][1]
+        if result and result.health:
+            valid.append(index)
+        else:
+            fail(
+                index,
+                "Could not retrieve service information. Please check the URL and response format.",
+            )
+
+    checked_at = datetime.utcnow()
+
+    def build_service(index: int) -> models.Service:
+        service = services[index]
+        base_url, result = checks[index]
+        health_info = result.health
+        return models.Service(
+            name=service.name,
+            url=base_url,
+            healthEndpoint=service.healthEndpoint,
+            response_format=HealthCheckService.stored_format(
+                service.response_format, result.format
+            ),
+            current_version=health_info.release,
+            database_schema=health_info.database_schema,
+            last_check_at=checked_at,
+            deployments=[],
+        )
+
+    pending = [(index, build_service(index)) for index in valid]
+    try:
+        db.add_all([db_service for _, db_service in pending])
+        await db.flush()
+    except IntegrityError:
+        # A concurrent request claimed one of the names; insert row by row
+        # inside savepoints so only the conflicting items fail
+        await db.rollback()
+        pending = []
+        for index in valid:
+            db_service = build_service(index)
+            try:
+                async with db.begin_nested():
+                    db.add(db_service)
+                pending.append((index, db_service))
+            except IntegrityError:
+                fail(index, "Service with this name already exists")
+
+    created = []
+    for index, db_service in pending:
+        results[index] = schemas.ServiceBulkResult(
+            index=index,
+            name=db_service.name,
+            success=True,
+            service=schemas.Service.from_orm(db_service),
+        )
+        created.append(service_event_payload(db_service))
+    await db.commit()
+
+    if created:
+        await cache.bump([service["id"] for service in created])
+        await manager.broadcast({"type": "services_created", "services": created})
+
+    return results
+
+
 @app.get("/services/", response_model=List[schemas.Service])
-def list_services(db: Session = Depends(get_db)):
-    return db.query(models.Service).all()
+async def list_services(
+    request: Request,
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    name_prefix: Optional[str] = None,
+    version: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    include: Optional[str] = Query(None, regex="^deployments$"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    async def load():
+        stmt = select(models.Service)
+        if name_prefix:
+            stmt = stmt.where(
+                models.Service.name.startswith(name_prefix, autoescape=True)
+            )
+        if version:
+            stmt = stmt.where(models.Service.current_version == version)
+        if created_after:
+            stmt = stmt.where(models.Service.created_at >= created_after)
+        if created_before:
+            stmt = stmt.where(models.Service.created_at < created_before)
+        if include == "deployments":
+            # One batched IN query for the whole page instead of one per service
+            stmt = stmt.options(selectinload(models.Service.deployments))
+        rows = await db.scalars(keyset_select(stmt, models.Service, after_id, limit))
+        rows, headers = split_page(rows.all(), limit)
+        return [schemas.Service.from_orm(row) for row in rows], headers
+
+    cache_version = await cache.get_version()
+    digest = cache.params_digest(request.query_params.multi_items())
+    return await cache.respond(
+        request,
+        f"cache:services:v{cache_version}:{digest}",
+        (
+            None
+            if cache_version is None
+            else cache.etag("services", cache_version, digest)
+        ),
+        load,
+    )
 
 
 @app.get("/services/{service_id}", response_model=schemas.Service)
-def get_service(service_id: int, db: Session = Depends(get_db)):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
-    if not service:
+async def get_service(
+    service_id: int, request: Request, db: AsyncSession = Depends(get_async_db)
+):
+    async def load():
+        service = await db.scalar(
+            select(models.Service)
+            .where(models.Service.id == service_id)
+            .options(selectinload(models.Service.deployments))
+        )
+        if not service:
+            raise HTTPException(status_code=404, detail="Service not found")
+        return schemas.Service.from_orm(service), {}
+
+    cache_version = await cache.get_version(service_id)
+    return await cache.respond(
+        request,
+        f"cache:service:{service_id}:v{cache_version}",
+        (
+            None
+            if cache_version is None
+            else cache.etag(f"service-{service_id}", cache_version)
+        ),
+        load,
+    )
+
+
+@app.get("/services/{service_id}/health/history", response_model=schemas.HealthHistory)
+async def get_health_history(
+    service_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    resolution: Optional[Resolution] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    if not health_history.enabled:
+        raise HTTPException(status_code=503, detail="Health history is disabled")
+    if await db.get(models.Service, service_id) is None:
         raise HTTPException(status_code=404, detail="Service not found")
-    return service
+
+    # Defaults to the last hour; naive datetimes are UTC
+    end_ts = utc_timestamp(end) if end else time.time()
+    start_ts = utc_timestamp(start) if start else end_ts - 3600
+    if start_ts > end_ts:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    if resolution is None:
+        # Minutes while they are retained for the whole range and fit one query
+        resolution = (
+            Resolution.MINUTE
+            if health_history.clamp_start(start_ts, end_ts, Resolution.MINUTE)
+            == start_ts
+            else Resolution.HOUR
+        )
+    # Older points have expired, or would not fit one query
+    start_ts = health_history.clamp_start(start_ts, end_ts, resolution)
+
+    try:
+        points = await health_history.query(service_id, start_ts, end_ts, resolution)
+    except RedisError as e:
+        logger.warning("Health history read failed: %s", e)
+        raise HTTPException(status_code=503, detail="Health history unavailable")
+
+    return {
+        "service_id": service_id,
+        "resolution": resolution.value,
+        "start": datetime.utcfromtimestamp(start_ts),
+        "end": datetime.utcfromtimestamp(end_ts),
+        "points": [
+            {**point, "timestamp": datetime.utcfromtimestamp(point["timestamp"])}
+            for point in points
+        ],
+    }
+
+
+def utc_timestamp(value: datetime) -> float:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
 
 
 @app.post("/services/{service_id}/deployments/", response_model=schemas.Deployment)
@@ -158,111 +529,424 @@ async def create_deployment(
     service_id: int,
     deployment: schemas.DeploymentCreate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
+    service = await db.get(models.Service, service_id)
     if not service:
         raise HTTPException(status_code=404, detail="Service not found")
 
-    # Create deployment record
-    db_deployment = models.Deployment(**deployment.dict(), service_id=service_id)
-    db.add(db_deployment)
-    db.commit()
-    db.refresh(db_deployment)
-
-    # Start Celery task
-    task = deploy_service.delay(service_id, service.url, deployment.version)
-
-    # Store task ID and update status
-    db_deployment.task_id = task.id
-    db_deployment.status = models.DeploymentStatus.IN_PROGRESS
-    db.commit()
+    (db_deployment,) = await start_deployments(db, [service], deployment.version)
+    # The service response embeds its deployments
+    await cache.bump([service_id])
 
     # Send WebSocket update
-    await manager.broadcast(
-        {
-            "type": "deployment_started",
-            "service_id": service_id,
-            "deployment_id": db_deployment.id,
-            "version": deployment.version,
-            "status": "in_progress",
-        }
-    )
+    await manager.broadcast(deployment_started_event(db_deployment))
 
     return db_deployment
 
 
+@app.post("/rollouts/", response_model=schemas.RolloutProgress)
+async def create_rollout(
+    rollout: schemas.RolloutCreate, db: AsyncSession = Depends(get_async_db)
+):
+    planned = await orchestrator.plan(db, rollout)
+    if not planned.service_ids:
+        raise HTTPException(
+            status_code=400,
+            detail=f"No selected service can be upgraded to {rollout.version}",
+        )
+    orchestrator.start(planned)
+    await orchestrator.store.save(planned.progress())
+    return planned.progress()
+
+
+@app.get("/rollouts/", response_model=List[schemas.RolloutProgress])
+async def list_rollouts():
+    return await orchestrator.list_progress()
+
+
+@app.get("/rollouts/{rollout_id}", response_model=schemas.RolloutProgress)
+async def get_rollout(rollout_id: str):
+    progress = await orchestrator.progress(rollout_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Rollout not found")
+    return progress
+
+
+@app.post("/rollouts/{rollout_id}/halt", response_model=schemas.RolloutProgress)
+async def halt_rollout(rollout_id: str):
+    try:
+        progress = await orchestrator.halt(rollout_id)
+    except RedisError:
+        raise HTTPException(status_code=503, detail="Rollout state unavailable")
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Rollout not found")
+    return progress
+
+
+# Plain `def` routes: FastAPI runs them in its threadpool, so their blocking
+# Session queries never run on the event loop.
 @app.get("/services/{service_id}/deployments/", response_model=List[schemas.Deployment])
-def list_deployments(service_id: int, db: Session = Depends(get_db)):
-    service = db.query(models.Service).filter(models.Service.id == service_id).first()
-    if not service:
+def list_deployments(
+    service_id: int,
+    response: Response,
+    after_id: Optional[int] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    version: Optional[str] = None,
+    status: Optional[models.DeploymentStatus] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+):
+    if db.get(models.Service, service_id) is None:
         raise HTTPException(status_code=404, detail="Service not found")
-    return service.deployments
+
+    stmt = select(models.Deployment).where(models.Deployment.service_id == service_id)
+    if version:
+        stmt = stmt.where(models.Deployment.version == version)
+    if status:
+        stmt = stmt.where(models.Deployment.status == status)
+    if created_after:
+        stmt = stmt.where(models.Deployment.created_at >= created_after)
+    if created_before:
+        stmt = stmt.where(models.Deployment.created_at < created_before)
+    rows = db.scalars(keyset_select(stmt, models.Deployment, after_id, limit)).all()
+    rows, headers = split_page(rows, limit)
+    response.headers.update(headers)
+    return rows
+
+
+def history_cursor(row) -> str:
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+
+@app.get("/deployments/history", response_model=List[schemas.Deployment])
+def get_deployment_history(
+    response: Response,
+    service_id: Optional[int] = None,
+    status: Optional[List[models.DeploymentStatus]] = Query(None),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    archived: bool = False,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    Deployments newest first, from `deployments` or, with archived=true,
+    from the archive. Ordered by (created_at, id) so the (service_id,
+    created_at) and (status, created_at) indexes serve both the filter and
+    the order; the next page is requested with cursor=<X-Next-Cursor>.
+    """
+    model = models.DeploymentArchive if archived else models.Deployment
+    stmt = select(model)
+    if service_id is not None:
+        stmt = stmt.where(model.service_id == service_id)
+    if status:
+        stmt = stmt.where(model.status.in_(status))
+    if created_after:
+        stmt = stmt.where(model.created_at >= created_after)
+    if created_before:
+        stmt = stmt.where(model.created_at < created_before)
+    if cursor:
+        try:
+            created_at, _, last_id = cursor.rpartition("_")
+            created_at, last_id = datetime.fromisoformat(created_at), int(last_id)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+        stmt = stmt.where(
+            or_(
+                model.created_at < created_at,
+                and_(model.created_at == created_at, model.id < last_id),
+            )
+        )
+    rows = db.scalars(
+        stmt.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+    ).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = history_cursor(rows[-1])
+    return rows
+
+
+@app.get("/deployments/status", response_model=List[schemas.DeploymentStatusInfo])
+def get_deployment_statuses(
+    background_tasks: BackgroundTasks,
+    ids: List[str] = Query(..., description="Deployment IDs, comma separated"),
+    db: Session = Depends(get_db),
+):
+    try:
+        deployment_ids = {
+            int(part) for value in ids for part in value.split(",") if part
+        }
+    except ValueError:
+        raise HTTPException(status_code=422, detail="ids must be integers")
+    if len(deployment_ids) > MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=422, detail=f"At most {MAX_PAGE_SIZE} ids per request"
+        )
+
+    deployments = db.scalars(
+        select(models.Deployment)
+        .where(models.Deployment.id.in_(deployment_ids))
+        .order_by(models.Deployment.id)
+    ).all()
+    messages = complete_finished_deployments(db, deployments)
+    # Serialize before committing, which would expire every row
+    statuses = [schemas.DeploymentStatusInfo.from_orm(row) for row in deployments]
+    db.commit()
+    notify_completed(background_tasks, messages)
+    return statuses
 
 
 @app.get("/deployments/{deployment_id}/status")
-def get_deployment_status(deployment_id: int, db: Session = Depends(get_db)):
-    deployment = (
-        db.query(models.Deployment)
-        .filter(models.Deployment.id == deployment_id)
-        .first()
-    )
+def get_deployment_status(
+    deployment_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+):
+    deployment = db.get(models.Deployment, deployment_id)
     if not deployment:
         raise HTTPException(status_code=404, detail="Deployment not found")
 
-    if deployment.task_id:
-        task = deploy_service.AsyncResult(deployment.task_id)
-        if task.ready():
-            result = task.get()
-            old_status = deployment.status
-            deployment.status = result["status"]
-            if deployment.status == models.DeploymentStatus.SUCCESS:
-                deployment.completed_at = datetime.utcnow()
-
-                # Update service version if deployment successful
-                service = (
-                    db.query(models.Service)
-                    .filter(models.Service.id == deployment.service_id)
-                    .first()
-                )
-                service.current_version = deployment.version
-
-                # Broadcast status change via WebSocket
-                background_tasks.add_task(
-                    manager.broadcast,
-                    {
-                        "type": "deployment_completed",
-                        "deployment_id": deployment.id,
-                        "service_id": deployment.service_id,
-                        "status": deployment.status,
-                        "version": deployment.version,
-                    },
-                )
-            elif deployment.status == models.DeploymentStatus.FAILED:
-                deployment.completed_at = datetime.utcnow()
-                # Broadcast failed status
-                background_tasks.add_task(
-                    manager.broadcast,
-                    {
-                        "type": "deployment_completed",
-                        "deployment_id": deployment.id,
-                        "service_id": deployment.service_id,
-                        "status": "failed",
-                        "error": result.get("error", "Unknown error"),
-                    },
-                )
-
-            if old_status != deployment.status:
-                db.commit()
-
-    return {
+    # Normally completed by deployment_listener as soon as the task finishes;
+    # this is the fallback for results that were not pushed
+    messages = complete_finished_deployments(db, [deployment])
+    status = {
         "status": deployment.status,
         "completed_at": deployment.completed_at,
         "version": deployment.version,
     }
+    db.commit()
+    notify_completed(background_tasks, messages)
+
+    return status
+
+
+@app.get("/deployments/stage-stats", response_model=schemas.DeploymentStageStats)
+def get_deployment_stage_stats(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    p50/p95 duration of every deployment stage over the most recent finished
+    deployments, to see which stage dominates rollout time
+    """
+    details = db.scalars(
+        select(models.Deployment.details)
+        .where(
+            models.Deployment.completed_at.is_not(None),
+            models.Deployment.details.is_not(None),
+        )
+        .order_by(models.Deployment.id.desc())
+        .limit(limit)
+    ).all()
+
+    durations: Dict[str, List[float]] = {}
+    for value in details:
+        try:
+            timings = json.loads(value).get("timings") or {}
+        except (ValueError, AttributeError):
+            continue
+        for stage, seconds in timings.items():
+            durations.setdefault(stage, []).append(float(seconds))
+
+    return schemas.DeploymentStageStats(
+        sample_size=len(details),
+        stages={
+            stage: schemas.StageDurationStats(
+                count=len(values),
+                p50=percentile(values, 50),
+                p95=percentile(values, 95),
+            )
+            for stage, values in durations.items()
+        },
+    )
 
 
-# Health check endpoint
+def percentile(values: List[float], rank: float) -> float:
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    index = max(0, math.ceil(rank / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def notify_completed(background_tasks: BackgroundTasks, messages: List[dict]):
+    if not messages:
+        return
+    background_tasks.add_task(
+        cache.bump, {message["service_id"] for message in messages}
+    )
+    # Broadcast status changes via WebSocket
+    for message in messages:
+        background_tasks.add_task(manager.broadcast, message)
+
+
+# NDJSON exports stream every matching row instead of building one page of
+# models in memory; meant for reporting jobs rather than the dashboard
+@app.get("/export/services.ndjson")
+async def export_services(
+    name_prefix: Optional[str] = None,
+    version: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+):
+    stmt = select(*SERVICE_FIELDS.values()).order_by(models.Service.id)
+    if name_prefix:
+        stmt = stmt.where(models.Service.name.startswith(name_prefix, autoescape=True))
+    if version:
+        stmt = stmt.where(models.Service.current_version == version)
+    if created_after:
+        stmt = stmt.where(models.Service.created_at >= created_after)
+    if created_before:
+        stmt = stmt.where(models.Service.created_at < created_before)
+    return StreamingResponse(
+        stream_ndjson(stmt, SERVICE_FIELDS), media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+@app.get("/export/deployments.ndjson")
+async def export_deployments(
+    service_id: Optional[int] = None,
+    version: Optional[str] = None,
+    status: Optional[models.DeploymentStatus] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+):
+    stmt = select(*DEPLOYMENT_FIELDS.values()).order_by(models.Deployment.id)
+    if service_id is not None:
+        stmt = stmt.where(models.Deployment.service_id == service_id)
+    if version:
+        stmt = stmt.where(models.Deployment.version == version)
+    if status:
+        stmt = stmt.where(models.Deployment.status == status)
+    if created_after:
+        stmt = stmt.where(models.Deployment.created_at >= created_after)
+    if created_before:
+        stmt = stmt.where(models.Deployment.created_at < created_before)
+    return StreamingResponse(
+        stream_ndjson(stmt, DEPLOYMENT_FIELDS), media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+def format_payload(mapping: FormatMapping) -> schemas.HealthFormat:
+    return schemas.HealthFormat(
+        name=mapping.name,
+        release=mapping.release,
+        schema=mapping.schema,
+        platform=mapping.platform,
+        platform_required=mapping.platform_required,
+        builtin=mapping.name in BUILTIN_FORMAT_NAMES,
+    )
+
+
+@app.get("/formats/", response_model=List[schemas.HealthFormat])
+async def list_formats(db: AsyncSession = Depends(get_async_db)):
+    await load_formats(db)
+    return [format_payload(mapping) for mapping in format_registry.mappings.values()]
+
+
+@app.post("/formats/", response_model=schemas.HealthFormat)
+async def create_format(
+    health_format: schemas.HealthFormatCreate, db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Registers a health response format. It is compiled right away and can be
+    used as the response_format of services, and AUTO detection tries it
+    after the built-in formats.
+    """
+    mapping = FormatMapping(
+        name=health_format.name,
+        release=health_format.release,
+        schema=health_format.database_schema,
+        platform=health_format.platform,
+        platform_required=health_format.platform_required,
+    )
+    if mapping.name in format_registry.mappings:
+        raise HTTPException(status_code=400, detail="Format already exists")
+    try:
+        # Validates the name and paths before anything is stored
+        format_registry.register(mapping)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    db.add(
+        models.HealthFormat(
+            name=mapping.name,
+            release_path=mapping.release,
+            schema_path=mapping.schema,
+            platform_path=mapping.platform,
+            platform_required=mapping.platform_required,
+        )
+    )
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        format_registry.unregister(mapping.name)
+        await load_formats(db)
+        raise HTTPException(status_code=400, detail="Format already exists")
+    return format_payload(mapping)
+
+
+@app.delete("/formats/{name}")
+async def delete_format(name: str, db: AsyncSession = Depends(get_async_db)):
+    if name in BUILTIN_FORMAT_NAMES:
+        raise HTTPException(
+            status_code=400, detail="Built-in formats cannot be deleted"
+        )
+    row = await db.scalar(
+        select(models.HealthFormat).where(models.HealthFormat.name == name)
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Format not found")
+    in_use = await db.scalar(
+        select(models.Service.id).where(models.Service.response_format == name).limit(1)
+    )
+    if in_use is not None:
+        raise HTTPException(status_code=409, detail="Format is used by services")
+    await db.delete(row)
+    await db.commit()
+    format_registry.unregister(name)
+    return {"message": "Format deleted"}
+
+
+# Liveness: the process is up and startup has not failed for good. Says
+# nothing about the database; see /health/ready
 @app.get("/health")
-async def health_check():
+@app.get("/health/live")
+async def health_check(response: Response):
+    if not readiness.live:
+        response.status_code = 503
+        return {"status": "failed", "error": readiness.error}
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+
+
+# Readiness: startup finished and the database and Redis respond
+@app.get("/health/ready")
+async def readiness_check(response: Response):
+    checks = await readiness.check()
+    ready = all(value == "ok" for value in checks.values())
+    if not ready:
+        response.status_code = 503
+    return {"status": "ready" if ready else "not_ready", "checks": checks}
+
+
+@app.get("/health/format-detection")
+async def format_detection_stats():
+    return format_detector.stats()
+
+
+@app.get("/health/cache")
+async def cache_stats():
+    return cache.stats()
+
+
+@app.get("/health/websocket")
+async def websocket_stats():
+    return manager.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,180 @@
+import logging
+import os
+import socket
+import time
+from typing import Any, Dict, Optional
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    push_to_gateway,
+)
+
+logger = logging.getLogger(__name__)
+
+# Directory shared by all processes in prometheus_client's multiprocess mode
+# (several uvicorn workers, or a worker on the same host)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Pushgateway the Celery worker pushes its deployment metrics to
+PROMETHEUS_PUSHGATEWAY_URL = os.getenv("PROMETHEUS_PUSHGATEWAY_URL")
+
+# Metrics recorded by the Celery worker, pushed as one group per process
+WORKER_REGISTRY = CollectorRegistry()
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+HEALTH_CHECK_LATENCY = Histogram(
+    "health_check_duration_seconds",
+    "Latency of service health checks that got a response",
+    ["format"],
+)
+HEALTH_CHECKS = Counter(
+    "health_checks_total",
+    "Service health checks by response format and outcome",
+    ["format", "outcome"],
+)
+FORMAT_DETECTIONS = Counter(
+    "health_format_detections_total",
+    "AUTO format detections: cache hits, detected and undetected payloads",
+    ["result"],
+)
+FORMAT_PARSE_ATTEMPTS = Counter(
+    "health_format_parse_attempts_total",
+    "Parsers tried while detecting the format of AUTO payloads",
+    ["format", "outcome"],
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_connections",
+    "Open WebSocket connections",
+    multiprocess_mode="livesum",
+)
+WEBSOCKET_SEND_LATENCY = Histogram(
+    "websocket_send_duration_seconds",
+    "Time to send one WebSocket message",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the database pool",
+    ["engine"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+DEPLOYMENT_STAGE_DURATION = Histogram(
+    "deployment_stage_duration_seconds",
+    "Duration of each deployment pipeline stage",
+    ["stage"],
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600),
+    registry=WORKER_REGISTRY,
+)
+
+
+class Children(dict):
+    """
+    Labelled children of a metric. labels() takes the metric's lock on every
+    call; hot paths look their child up in this plain dict instead.
+    """
+
+    def __init__(self, metric):
+        super().__init__()
+        self.metric = metric
+
+    def __missing__(self, labels):
+        child = self[labels] = self.metric.labels(*labels)
+        return child
+
+
+request_latency = Children(REQUEST_LATENCY)
+health_check_latency = Children(HEALTH_CHECK_LATENCY)
+health_checks = Children(HEALTH_CHECKS)
+format_detections = Children(FORMAT_DETECTIONS)
+format_parse_attempts = Children(FORMAT_PARSE_ATTEMPTS)
+db_pool_checkout_wait = Children(DB_POOL_CHECKOUT_WAIT)
+
+
+def record_health_check(format: str, outcome: str, latency_ms: Optional[float]):
+    health_checks[(format, outcome)].inc()
+    if latency_ms is not None:
+        health_check_latency[(format,)].observe(latency_ms / 1000)
+
+
+def record_stage_durations(timings: Dict[str, Any]):
+    """
+    Records the stage durations of a finished deployment and pushes them to
+    the Pushgateway, if one is configured
+    """
+    for stage, duration in (timings or {}).items():
+        DEPLOYMENT_STAGE_DURATION.labels(stage).observe(float(duration))
+    if not PROMETHEUS_PUSHGATEWAY_URL:
+        return
+    try:
+        push_to_gateway(
+            PROMETHEUS_PUSHGATEWAY_URL,
+            job="deployment_worker",
+            registry=WORKER_REGISTRY,
+            grouping_key={"instance": f"{socket.gethostname()}:{os.getpid()}"},
+            timeout=2,
+        )
+    except Exception as e:
+        logger.warning("Failed to push deployment metrics: %s", e)
+
+
+def render_metrics() -> bytes:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY) + generate_latest(WORKER_REGISTRY)
+
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware recording the latency of every HTTP request under its
+    route template (e.g. /services/{service_id}), so IDs do not multiply the
+    label values. Requests that match no route share one label value.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[Any, str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_latency[(scope["method"], self._route(scope), str(status))].observe(
+                time.perf_counter() - started
+            )
+
+    def _route(self, scope) -> str:
+        # The router adds the matched endpoint to the scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            for candidate in scope["app"].routes:
+                if getattr(candidate, "endpoint", None) is not None:
+                    self._routes[candidate.endpoint] = candidate.path
+            route = self._routes.get(endpoint, "unmatched")
+        return route
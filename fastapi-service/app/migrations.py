@@ -0,0 +1,157 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Optional, Set
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    func,
+    inspect,
+    insert,
+    select,
+    text,
+)
+from sqlalchemy.dialects.mysql import ENUM
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Versions applied to this database. Not part of models.Base, so that it is
+# only ever created here.
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100)),
+    Column("applied_at", DateTime),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    One schema change. apply must be idempotent: DDL is not transactional on
+    MySQL, so a migration interrupted half-way, or raced by another process,
+    is simply applied again.
+    """
+
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def create_tables(*tables: Table) -> Callable[[Connection], None]:
+    def apply(connection: Connection):
+        for table in tables:
+            table.create(connection, checkfirst=True)
+
+    return apply
+
+
+def create_indexes(table: Table) -> Callable[[Connection], None]:
+    def apply(connection: Connection):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+    return apply
+
+
+def widen_response_format(connection: Connection):
+    # Before custom health formats, services.response_format was a MySQL
+    # ENUM of the built-in names (upper case); other databases stored it as
+    # VARCHAR already
+    if connection.dialect.name != "mysql":
+        return
+    columns = {
+        column["name"]: column["type"]
+        for column in inspect(connection).get_columns("services")
+    }
+    if not isinstance(columns.get("response_format"), ENUM):
+        return
+    connection.execute(text("ALTER TABLE services MODIFY response_format VARCHAR(50)"))
+    connection.execute(
+        text("UPDATE services SET response_format = LOWER(response_format)")
+    )
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "initial_schema",
+        create_tables(
+            models.Service.__table__,
+            models.Deployment.__table__,
+            models.HealthFormat.__table__,
+        ),
+    ),
+    Migration(
+        2,
+        "deployment_history_indexes",
+        create_indexes(models.Deployment.__table__),
+    ),
+    Migration(3, "response_format_varchar", widen_response_format),
+    Migration(
+        4,
+        "deployments_archive",
+        create_tables(models.DeploymentArchive.__table__),
+    ),
+    Migration(
+        5,
+        "deployments_task_id_index",
+        create_indexes(models.Deployment.__table__),
+    ),
+]
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(connection: Connection) -> Optional[int]:
+    """
+    Latest migration applied to this database, None before the first one
+    """
+    if not inspect(connection).has_table(schema_migrations.name):
+        return None
+    return connection.scalar(select(func.max(schema_migrations.c.version)))
+
+
+def applied_versions(connection: Connection) -> Set[int]:
+    return set(connection.scalars(select(schema_migrations.c.version)))
+
+
+def migrate(engine: Engine) -> Set[int]:
+    """
+    Applies the migrations this database has not seen yet, in order, and
+    returns their versions
+    """
+    with engine.begin() as connection:
+        schema_migrations.create(connection, checkfirst=True)
+        applied = applied_versions(connection)
+
+    newly_applied = set()
+    for migration in MIGRATIONS:
+        if migration.version in applied:
+            continue
+        logger.info("Applying migration %d (%s)", migration.version, migration.name)
+        try:
+            with engine.begin() as connection:
+                migration.apply(connection)
+                connection.execute(
+                    insert(schema_migrations).values(
+                        version=migration.version,
+                        name=migration.name,
+                        applied_at=datetime.utcnow(),
+                    )
+                )
+        except IntegrityError:
+            # Recorded by another process starting at the same time
+            logger.info("Migration %d was applied concurrently", migration.version)
+            continue
+        newly_applied.add(migration.version)
+    return newly_applied
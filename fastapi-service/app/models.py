@@ -1,7 +1,16 @@
 import enum
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Enum, ForeignKey, Integer, String
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -31,7 +40,8 @@ class Service(Base):
     name = Column(String(100), unique=True, index=True)
     url = Column(String(200))
     healthEndpoint = Column(String(100), default="/api/health/info")
-    response_format = Column(Enum(ResponseFormat), default=ResponseFormat.AUTO)
+    # A built-in ResponseFormat value or the name of a registered HealthFormat
+    response_format = Column(String(50), default=ResponseFormat.AUTO.value)
     current_version = Column(String(50))
     database_schema = Column(String(100))
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -56,10 +66,55 @@ class Deployment(Base):
     id = Column(Integer, primary_key=True, index=True)
     service_id = Column(Integer, ForeignKey("services.id"))
     version = Column(String(50))
-    task_id = Column(String(100), nullable=True)
+    # Completion events from the worker look deployments up by task ID
+    task_id = Column(String(100), nullable=True, index=True)
     status = Column(Enum(DeploymentStatus), default=DeploymentStatus.PENDING)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     details = Column(String(500), nullable=True)
 
     service = relationship("Service", back_populates="deployments")
+
+    # Per-service history by time, and fleet-wide lookups by status (the
+    # archival job's terminal deployments older than a cutoff)
+    __table_args__ = (
+        Index("ix_deployments_service_id_created_at", "service_id", "created_at"),
+        Index("ix_deployments_status_created_at", "status", "created_at"),
+    )
+
+
+# Terminal deployments moved out of `deployments` by archive.DeploymentArchiver,
+# keeping their IDs
+class DeploymentArchive(Base):
+    __tablename__ = "deployments_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    service_id = Column(Integer)
+    version = Column(String(50))
+    task_id = Column(String(100), nullable=True)
+    status = Column(Enum(DeploymentStatus))
+    created_at = Column(DateTime)
+    completed_at = Column(DateTime, nullable=True)
+    details = Column(String(500), nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "ix_deployments_archive_service_id_created_at", "service_id", "created_at"
+        ),
+        Index("ix_deployments_archive_status_created_at", "status", "created_at"),
+    )
+
+
+# Health response format registered at runtime, as field paths into the
+# payload (see health_formats.FormatMapping)
+class HealthFormat(Base):
+    __tablename__ = "health_formats"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(50), unique=True, index=True)
+    release_path = Column(String(200))
+    schema_path = Column(String(200))
+    platform_path = Column(String(200), nullable=True)
+    platform_required = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import select, update
+
+from . import models
+from .cache import cache
+from .database import AsyncSessionLocal
+from .health_formats import ensure_formats
+from .health_history import HealthSample, health_history
+from .health_service import HealthCheckService, HealthFetchResult, HealthValidators
+from .logging_config import correlation_id, new_correlation_id
+from .websocket import manager
+
+logger = logging.getLogger(__name__)
+
+HEALTH_POLL_ENABLED = os.getenv("HEALTH_POLL_ENABLED", "true").lower() == "true"
+# Seconds between the start of two sweeps
+HEALTH_POLL_INTERVAL = float(os.getenv("HEALTH_POLL_INTERVAL", "30"))
+# Maximum number of health checks in flight at once
+HEALTH_POLL_CONCURRENCY = int(os.getenv("HEALTH_POLL_CONCURRENCY", "100"))
+# Each check is delayed by a random 0..JITTER seconds to spread load
+HEALTH_POLL_JITTER = float(os.getenv("HEALTH_POLL_JITTER", "2"))
+HEALTH_POLL_TIMEOUT = float(os.getenv("HEALTH_POLL_TIMEOUT", "5"))
+# Minimum seconds between last_check_at refreshes of services whose health did not change
+HEALTH_POLL_TOUCH_INTERVAL = float(os.getenv("HEALTH_POLL_TOUCH_INTERVAL", "300"))
+
+
+class HealthPoller:
+    """
+    Periodically sweeps every registered service and refreshes its
+    version/schema columns. All checks of a sweep share one pooled
+    httpx.AsyncClient and conditional requests; the changed rows are
+    written back in a single bulk UPDATE.
+    """
+
+    def __init__(
+        self,
+        interval: float = HEALTH_POLL_INTERVAL,
+        concurrency: int = HEALTH_POLL_CONCURRENCY,
+        jitter: float = HEALTH_POLL_JITTER,
+        timeout: float = HEALTH_POLL_TIMEOUT,
+        touch_interval: float = HEALTH_POLL_TOUCH_INTERVAL,
+    ):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.timeout = timeout
+        self.touch_interval = touch_interval
+        self.client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        # Per-service ETag/Last-Modified/body hash of the last persisted response
+        self._validators: Dict[int, HealthValidators] = {}
+        self._last_touch = float("-inf")
+
+    def start(self):
+        if self._task is not None:
+            return
+        self.get_client()
+        self._task = asyncio.create_task(self.run())
+
+    def get_client(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.concurrency,
+                    max_keepalive_connections=self.concurrency,
+                ),
+            )
+        return self.client
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            # Everything logged during one sweep shares a correlation ID
+            correlation_id.set(f"sweep-{new_correlation_id()}")
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Health poll sweep failed")
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(max(0.0, self.interval - elapsed))
+
+    async def sweep(self) -> int:
+        """
+        Checks every service once and returns the number of rows updated.
+        Only services whose version or schema actually changed are written
+        and broadcast; unchanged responses are skipped before parsing.
+        """
+        services = await self._load_services()
+        if not services:
+            self._validators.clear()
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(self._check(service, semaphore) for service in services)
+        )
+
+        checked_at = datetime.utcnow()
+        await health_history.record(
+            [self._sample(service, result, time.time()) for service, result in results]
+        )
+        validators: Dict[int, HealthValidators] = {}
+        rows: List[Dict[str, Any]] = []
+        format_rows: List[Dict[str, Any]] = []
+        changed: List[Dict[str, Any]] = []
+        healthy_ids: List[int] = []
+        for service, result in results:
+            if result is None or not (result.not_modified or result.health):
+                continue
+            validators[service.id] = result.validators
+            healthy_ids.append(service.id)
+            if result.not_modified:
+                continue
+
+            health_info = result.health
+            response_format = HealthCheckService.stored_format(
+                service.response_format, result.format
+            )
+            if response_format != service.response_format:
+                format_rows.append(
+                    {"id": service.id, "response_format": response_format}
+                )
+            if (
+                service.current_version == health_info.release
+                and service.database_schema == health_info.database_schema
+            ):
+                continue
+            row = {
+                "id": service.id,
+                "current_version": health_info.release,
+                "database_schema": health_info.database_schema,
+                "last_check_at": checked_at,
+            }
+            rows.append(row)
+            changed.append({**row, "name": service.name, "url": service.url})
+
+        # last_check_at of unchanged services is only refreshed every
+        # HEALTH_POLL_TOUCH_INTERVAL, in a single statement
+        touch_ids: List[int] = []
+        if time.monotonic() - self._last_touch >= self.touch_interval:
+            changed_ids = {row["id"] for row in rows}
+            touch_ids = [
+                service_id
+                for service_id in healthy_ids
+                if service_id not in changed_ids
+            ]
+
+        if rows or format_rows or touch_ids:
+            await self._write_results(rows, format_rows, touch_ids, checked_at)
+            await cache.bump({row["id"] for row in rows + format_rows}.union(touch_ids))
+        if touch_ids:
+            self._last_touch = time.monotonic()
+
+        # Only remember validators once the results they describe are persisted
+        self._validators = validators
+
+        for service in changed:
+            await manager.broadcast(
+                {
+                    "type": "service_updated",
+                    "service": {
+                        "id": service["id"],
+                        "name": service["name"],
+                        "url": service["url"],
+                        "current_version": service["current_version"],
+                        "database_schema": service["database_schema"],
+                    },
+                }
+            )
+
+        return len(rows)
+
+    async def _check(
+        self, service, semaphore: asyncio.Semaphore
+    ) -> Tuple[Any, Optional[HealthFetchResult]]:
+        if self.jitter > 0:
+            await asyncio.sleep(random.uniform(0, self.jitter))
+        async with semaphore:
+            result = await HealthCheckService.fetch_health(
+                self.get_client(),
+                f"{service.url}{service.healthEndpoint}",
+                service.response_format or models.ResponseFormat.AUTO.value,
+                self._validators.get(service.id),
+            )
+        return service, result
+
+    @staticmethod
+    def _sample(service, result: Optional[HealthFetchResult], timestamp: float):
+        if result is None:
+            return HealthSample(service_id=service.id, timestamp=timestamp, ok=False)
+        ok = result.not_modified or result.health is not None
+        if result.health is not None:
+            release = result.health.release
+            schema = result.health.database_schema
+        elif result.not_modified:
+            release, schema = service.current_version, service.database_schema
+        else:
+            release = schema = None
+        return HealthSample(
+            service_id=service.id,
+            timestamp=timestamp,
+            ok=ok,
+            status_code=result.status_code,
+            latency_ms=result.latency_ms,
+            release=release,
+            database_schema=schema,
+        )
+
+    @staticmethod
+    async def _load_services():
+        async with AsyncSessionLocal() as db:
+            formats = await db.scalars(
+                select(models.Service.response_format).distinct()
+            )
+            # Formats registered through another API process since startup
+            await ensure_formats(db, [format for format in formats if format])
+            result = await db.execute(
+                select(
+                    models.Service.id,
+                    models.Service.name,
+                    models.Service.url,
+                    models.Service.healthEndpoint,
+                    models.Service.response_format,
+                    models.Service.current_version,
+                    models.Service.database_schema,
+                )
+            )
+            return result.all()
+
+    @staticmethod
+    async def _write_results(
+        rows: List[Dict[str, Any]],
+        format_rows: List[Dict[str, Any]],
+        touch_ids: List[int],
+        checked_at: datetime,
+    ):
+        async with AsyncSessionLocal() as db:
+            if rows:
+                # ORM bulk UPDATE by primary key: one executemany for the whole sweep
+                await db.execute(update(models.Service), rows)
+            if format_rows:
+                await db.execute(update(models.Service), format_rows)
+            if touch_ids:
+                await db.execute(
+                    update(models.Service)
+                    .where(models.Service.id.in_(touch_ids))
+                    .values(last_check_at=checked_at)
+                )
+            await db.commit()
+
+
+poller = HealthPoller()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import redis.asyncio as aioredis
+from sqlalchemy import text
+
+from .celery_app import CELERY_REDIS_URL
+from .database import async_engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds a single dependency check of /health/ready may take
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "1"))
+
+OK = "ok"
+
+
+class Readiness:
+    """
+    Runs the API's startup phase in the background, so the process is live
+    (and serves probes) while it waits for its dependencies, and answers
+    readiness: ready once startup has finished and the database and the
+    Celery broker's Redis respond.
+    """
+
+    def __init__(
+        self, redis_url: str = CELERY_REDIS_URL, timeout: float = READINESS_TIMEOUT
+    ):
+        self.redis_url = redis_url
+        self.timeout = timeout
+        self.redis: Optional[aioredis.Redis] = None
+        self.started = False
+        # Set if startup failed for good; the process is then no longer live
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, startup: Callable[[], Awaitable[None]]):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(startup))
+
+    async def _run(self, startup: Callable[[], Awaitable[None]]):
+        started = time.monotonic()
+        try:
+            await startup()
+        except Exception as e:
+            self.error = str(e)
+            logger.exception("Startup failed")
+            return
+        self.started = True
+        logger.info("Startup finished in %.3f seconds", time.monotonic() - started)
+
+    async def wait(self) -> bool:
+        """
+        Waits for the startup phase and returns whether it succeeded
+        """
+        if self._task is not None:
+            await asyncio.shield(self._task)
+        return self.started
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    @property
+    def live(self) -> bool:
+        return self.error is None
+
+    async def check(self) -> Dict[str, str]:
+        """
+        "ok" or the reason it is not, for startup (database reachable, schema
+        migrated, pools warmed, background services started), the database
+        and Redis
+        """
+        if self.started:
+            startup = OK
+        else:
+            startup = self.error or "pending"
+        database, redis = await asyncio.gather(
+            self._probe(self._check_database), self._probe(self._check_redis)
+        )
+        return {"startup": startup, "database": database, "redis": redis}
+
+    async def _probe(self, check: Callable[[], Awaitable[None]]) -> str:
+        try:
+            await asyncio.wait_for(check(), self.timeout)
+        except asyncio.TimeoutError:
+            return "timeout"
+        except Exception as e:
+            # First line only; SQLAlchemy appends a link to its docs
+            return str(e).split("\n", 1)[0] or e.__class__.__name__
+        return OK
+
+    async def _check_database(self):
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    async def _check_redis(self):
+        if self.redis is None:
+            self.redis = aioredis.from_url(
+                self.redis_url,
+                socket_connect_timeout=self.timeout,
+                socket_timeout=self.timeout,
+            )
+        await self.redis.ping()
+
+
+readiness = Readiness()
@@ -0,0 +1,437 @@
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+from typing import Dict, List, Optional
+from uuid import uuid4
+
+import redis.asyncio as aioredis
+from fastapi.encoders import jsonable_encoder
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .cache import cache
+from .celery_app import CELERY_REDIS_URL, validate_semantic_version
+from .database import AsyncSessionLocal
+from .deployment_events import (
+    TERMINAL_STATUSES,
+    deployment_started_event,
+    start_deployments,
+)
+from .websocket import manager
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two checks of a wave's in-flight deployments
+ROLLOUT_POLL_INTERVAL = float(os.getenv("ROLLOUT_POLL_INTERVAL", "2"))
+# Number of finished rollouts kept for GET /rollouts/
+ROLLOUT_HISTORY = 100
+# Seconds the shared progress of a rollout is kept after its last update
+ROLLOUT_STATE_TTL = 7 * 24 * 60 * 60
+
+
+class RolloutStatus(str, Enum):
+    RUNNING = "running"
+    COMPLETED = "completed"
+    HALTED = "halted"
+
+
+@dataclass
+class Rollout:
+    id: str
+    version: str
+    canary_size: int
+    batch_size: int
+    max_in_flight: int
+    max_failure_rate: float
+    # Target services in deployment order, and the ones left out (including
+    # targets deleted before their wave started)
+    service_ids: List[int]
+    skipped_service_ids: List[int]
+    status: RolloutStatus = RolloutStatus.RUNNING
+    wave: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    halt_reason: Optional[str] = None
+    # service_id -> deployment_id of every deployment started so far
+    deployments: Dict[int, int] = field(default_factory=dict)
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    completed_at: Optional[datetime] = None
+
+    @property
+    def waves(self) -> List[List[int]]:
+        """
+        The canary wave (if any) followed by batches of batch_size
+        """
+        canary = self.service_ids[: self.canary_size]
+        rest = self.service_ids[self.canary_size :]
+        waves = [canary] if canary else []
+        waves.extend(
+            rest[start : start + self.batch_size]
+            for start in range(0, len(rest), self.batch_size)
+        )
+        return waves
+
+    @property
+    def failure_rate(self) -> float:
+        finished = self.succeeded + self.failed
+        return self.failed / finished if finished else 0.0
+
+    def halt(self, reason: str):
+        if self.status == RolloutStatus.RUNNING:
+            self.status = RolloutStatus.HALTED
+            self.halt_reason = reason
+
+    def progress(self) -> dict:
+        dispatched = len(self.deployments)
+        return {
+            "id": self.id,
+            "version": self.version,
+            "status": self.status,
+            "wave": self.wave,
+            "total_waves": len(self.waves),
+            "total": len(self.service_ids),
+            "skipped": len(self.skipped_service_ids),
+            "dispatched": dispatched,
+            "in_flight": dispatched - self.succeeded - self.failed,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "failure_rate": self.failure_rate,
+            "halt_reason": self.halt_reason,
+            "created_at": self.created_at,
+            "completed_at": self.completed_at,
+        }
+
+
+class RolloutStore:
+    """
+    Progress of every rollout in Redis, shared by all API processes: the
+    process running a rollout writes it on every change, the others answer
+    GET /rollouts/ from it and pass halt requests on through it. Without
+    Redis, each process only knows its own rollouts.
+    """
+
+    INDEX_KEY = "rollouts"
+
+    def __init__(self, url: str = CELERY_REDIS_URL):
+        self.url = url
+        self.redis: Optional[aioredis.Redis] = None
+
+    def get_redis(self) -> aioredis.Redis:
+        if self.redis is None:
+            self.redis = aioredis.from_url(
+                self.url, socket_connect_timeout=1, socket_timeout=1
+            )
+        return self.redis
+
+    @staticmethod
+    def _key(rollout_id: str) -> str:
+        return f"rollout:{rollout_id}"
+
+    async def save(self, progress: dict):
+        try:
+            async with self.get_redis().pipeline(transaction=False) as pipe:
+                pipe.set(
+                    self._key(progress["id"]),
+                    json.dumps(jsonable_encoder(progress)),
+                    ex=ROLLOUT_STATE_TTL,
+                )
+                pipe.zadd(
+                    self.INDEX_KEY, {progress["id"]: progress["created_at"].timestamp()}
+                )
+                pipe.zremrangebyrank(self.INDEX_KEY, 0, -ROLLOUT_HISTORY - 1)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Failed to save rollout %s: %s", progress["id"], e)
+
+    async def load(self, rollout_id: str) -> Optional[dict]:
+        try:
+            raw = await self.get_redis().get(self._key(rollout_id))
+        except RedisError as e:
+            logger.warning("Failed to load rollout %s: %s", rollout_id, e)
+            return None
+        return json.loads(raw) if raw else None
+
+    async def list(self) -> List[dict]:
+        try:
+            redis = self.get_redis()
+            rollout_ids = await redis.zrange(self.INDEX_KEY, 0, -1)
+            values = (
+                await redis.mget(
+                    [self._key(rollout_id.decode()) for rollout_id in rollout_ids]
+                )
+                if rollout_ids
+                else []
+            )
+        except RedisError as e:
+            logger.warning("Failed to list rollouts: %s", e)
+            return []
+        return [json.loads(value) for value in values if value]
+
+    async def request_halt(self, rollout_id: str):
+        await self.get_redis().set(
+            f"{self._key(rollout_id)}:halt", 1, ex=ROLLOUT_STATE_TTL
+        )
+
+    async def halt_requested(self, rollout_id: str) -> bool:
+        try:
+            return bool(await self.get_redis().exists(f"{self._key(rollout_id)}:halt"))
+        except RedisError as e:
+            logger.warning("Failed to read halt request of %s: %s", rollout_id, e)
+            return False
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+
+class RolloutOrchestrator:
+    """
+    Deploys one version to a selection of services in waves: a canary wave
+    first, then batches of batch_size, each with at most max_in_flight
+    deployments running at once. Every wave waits for its deployments to
+    finish before the next one starts, and no new deployment is started once
+    the failure rate of the rollout exceeds max_failure_rate.
+
+    Deployments are regular Deployment rows completed by the deployment event
+    listener; the orchestrator only reads their status back, in one query per
+    poll for the whole wave.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = ROLLOUT_POLL_INTERVAL,
+        store: Optional[RolloutStore] = None,
+    ):
+        self.poll_interval = poll_interval
+        self.store = store or RolloutStore()
+        # Rollouts started by this process
+        self.rollouts: Dict[str, Rollout] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def plan(self, db: AsyncSession, request: schemas.RolloutCreate) -> Rollout:
+        """
+        Resolves the selector into the services to deploy. Services that
+        cannot be upgraded to the version, or already have a deployment in
+        progress, are skipped.
+        """
+        selector = request.selector
+        stmt = select(models.Service).order_by(models.Service.id)
+        if selector.service_ids is not None:
+            stmt = stmt.where(models.Service.id.in_(selector.service_ids))
+        if selector.name_prefix:
+            stmt = stmt.where(
+                models.Service.name.startswith(selector.name_prefix, autoescape=True)
+            )
+        if selector.current_version:
+            stmt = stmt.where(
+                models.Service.current_version == selector.current_version
+            )
+        services = (await db.scalars(stmt)).all()
+
+        busy = set(
+            (
+                await db.scalars(
+                    select(models.Deployment.service_id).where(
+                        models.Deployment.service_id.in_(
+                            [service.id for service in services]
+                        ),
+                        models.Deployment.status == models.DeploymentStatus.IN_PROGRESS,
+                    )
+                )
+            ).all()
+        )
+        targets, skipped = [], []
+        for service in services:
+            if service.id not in busy and validate_semantic_version(
+                service.current_version or "", request.version
+            ):
+                targets.append(service.id)
+            else:
+                skipped.append(service.id)
+
+        return Rollout(
+            id=str(uuid4()),
+            version=request.version,
+            canary_size=request.canary_size,
+            batch_size=request.batch_size,
+            max_in_flight=request.max_in_flight,
+            max_failure_rate=request.max_failure_rate,
+            service_ids=targets,
+            skipped_service_ids=skipped,
+        )
+
+    def start(self, rollout: Rollout):
+        self._prune()
+        self.rollouts[rollout.id] = rollout
+        self._tasks[rollout.id] = asyncio.create_task(self.run(rollout))
+
+    def get(self, rollout_id: str) -> Optional[Rollout]:
+        return self.rollouts.get(rollout_id)
+
+    async def progress(self, rollout_id: str) -> Optional[dict]:
+        """
+        Progress of a rollout run by any API process
+        """
+        rollout = self.get(rollout_id)
+        if rollout is not None:
+            return rollout.progress()
+        return await self.store.load(rollout_id)
+
+    async def list_progress(self) -> List[dict]:
+        shared = {progress["id"]: progress for progress in await self.store.list()}
+        # Local rollouts are at least as fresh as their shared copy
+        shared.update(
+            (rollout.id, rollout.progress()) for rollout in self.rollouts.values()
+        )
+        return list(shared.values())
+
+    async def halt(self, rollout_id: str) -> Optional[dict]:
+        """
+        Halts a rollout: deployments already in flight finish, no new ones
+        are started. A rollout run by another process stops at its next poll.
+        """
+        rollout = self.get(rollout_id)
+        if rollout is not None:
+            rollout.halt("Halted by user")
+            await self.store.save(rollout.progress())
+            return rollout.progress()
+        progress = await self.store.load(rollout_id)
+        if progress is not None and progress["status"] == RolloutStatus.RUNNING:
+            await self.store.request_halt(rollout_id)
+        return progress
+
+    async def stop(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+        await self.store.close()
+
+    async def run(self, rollout: Rollout):
+        try:
+            for index, wave in enumerate(rollout.waves):
+                if rollout.status != RolloutStatus.RUNNING:
+                    break
+                rollout.wave = index + 1
+                await self._run_wave(rollout, wave)
+            if rollout.status == RolloutStatus.RUNNING:
+                rollout.status = RolloutStatus.COMPLETED
+        except asyncio.CancelledError:
+            rollout.halt("Server shutting down")
+            raise
+        except Exception as e:
+            logger.exception("Rollout %s failed", rollout.id)
+            rollout.halt(f"Rollout error: {str(e)}")
+        finally:
+            rollout.completed_at = datetime.utcnow()
+            self._tasks.pop(rollout.id, None)
+            await self.broadcast(rollout)
+
+    async def _run_wave(self, rollout: Rollout, wave: List[int]):
+        pending = list(wave)
+        # deployment_id -> service_id
+        in_flight: Dict[int, int] = {}
+        while True:
+            if rollout.status != RolloutStatus.RUNNING:
+                pending.clear()
+            room = rollout.max_in_flight - len(in_flight)
+            if pending and room > 0:
+                batch, pending = pending[:room], pending[room:]
+                await self._dispatch(rollout, batch, in_flight)
+                await self.broadcast(rollout)
+            if not pending and not in_flight:
+                return
+
+            await asyncio.sleep(self.poll_interval)
+            if await self.store.halt_requested(rollout.id):
+                rollout.halt("Halted by user")
+            if await self._collect(rollout, in_flight):
+                if rollout.failure_rate > rollout.max_failure_rate:
+                    rollout.halt(
+                        f"Failure rate {rollout.failure_rate:.0%} exceeded "
+                        f"{rollout.max_failure_rate:.0%}"
+                    )
+                await self.broadcast(rollout)
+
+    async def _dispatch(
+        self, rollout: Rollout, service_ids: List[int], in_flight: Dict[int, int]
+    ):
+        async with AsyncSessionLocal() as db:
+            services = (
+                await db.scalars(
+                    select(models.Service).where(models.Service.id.in_(service_ids))
+                )
+            ).all()
+            deployments = await start_deployments(db, services, rollout.version)
+
+        # Services deleted since the rollout was planned are never deployed
+        found = {service.id for service in services}
+        rollout.skipped_service_ids.extend(
+            service_id for service_id in service_ids if service_id not in found
+        )
+        for deployment in deployments:
+            rollout.deployments[deployment.service_id] = deployment.id
+            in_flight[deployment.id] = deployment.service_id
+        await cache.bump(service_ids)
+        # Announced like the deployments of POST /services/{id}/deployments/
+        for deployment in deployments:
+            await manager.broadcast(deployment_started_event(deployment))
+
+    @staticmethod
+    async def _collect(rollout: Rollout, in_flight: Dict[int, int]) -> int:
+        """
+        Removes the finished deployments from in_flight and counts them.
+        Returns how many finished.
+        """
+        async with AsyncSessionLocal() as db:
+            statuses = dict(
+                (
+                    await db.execute(
+                        select(models.Deployment.id, models.Deployment.status).where(
+                            models.Deployment.id.in_(list(in_flight))
+                        )
+                    )
+                ).all()
+            )
+
+        finished = 0
+        for deployment_id in list(in_flight):
+            status = statuses.get(deployment_id, models.DeploymentStatus.FAILED)
+            if status not in TERMINAL_STATUSES:
+                continue
+            del in_flight[deployment_id]
+            finished += 1
+            if status == models.DeploymentStatus.SUCCESS:
+                rollout.succeeded += 1
+            else:
+                rollout.failed += 1
+        return finished
+
+    async def broadcast(self, rollout: Rollout):
+        progress = rollout.progress()
+        await self.store.save(progress)
+        await manager.broadcast(
+            {"type": "rollout_progress", "rollout": jsonable_encoder(progress)}
+        )
+
+    def _prune(self):
+        finished = [
+            rollout
+            for rollout in self.rollouts.values()
+            if rollout.status != RolloutStatus.RUNNING
+        ]
+        for rollout in finished[: max(0, len(finished) - ROLLOUT_HISTORY + 1)]:
+            del self.rollouts[rollout.id]
+
+
+orchestrator = RolloutOrchestrator()
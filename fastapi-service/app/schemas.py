@@ -1,16 +1,41 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl, validator
+from pydantic.utils import GetterDict
+from sqlalchemy import inspect
 
-from .models import DeploymentStatus, ResponseFormat
+from .models import DeploymentStatus
+
+
+class LoadedRelationshipsGetter(GetterDict):
+    """
+    orm_mode getter that never triggers a lazy load: relationships that were
+    not loaded with the query are treated as missing, so the field default is
+    used instead of emitting one query per row.
+    """
+
+    def get(self, key, default=None):
+        state = inspect(self._obj, raiseerr=False)
+        if (
+            state is not None
+            and key in state.mapper.relationships
+            and key in state.unloaded
+        ):
+            return default
+        return getattr(self._obj, key, default)
 
 
 class ServiceBase(BaseModel):
     name: str
     url: str
     healthEndpoint: str = "/api/health/info"  # Default endpoint, test için
-    response_format: ResponseFormat
+    # A ResponseFormat value or the name of a registered health format
+    response_format: str
+
+    @validator("response_format")
+    def normalize_response_format(cls, value):
+        return value.lower() if value else value
 
 
 class ServiceCreate(ServiceBase):
@@ -25,7 +50,7 @@ class ServiceCreate(ServiceBase):
 class ServiceUpdate(ServiceBase):
     name: Optional[str] = None
     url: Optional[str] = None
-    response_format: Optional[ResponseFormat] = None
+    response_format: Optional[str] = None
 
 
 class DeploymentBase(BaseModel):
@@ -48,17 +73,112 @@ class Deployment(DeploymentBase):
         orm_mode = True
 
 
+class DeploymentStatusInfo(BaseModel):
+    id: int
+    status: DeploymentStatus
+    completed_at: Optional[datetime] = None
+    version: str
+
+    class Config:
+        orm_mode = True
+
+
+class StageDurationStats(BaseModel):
+    count: int
+    p50: float
+    p95: float
+
+
+class DeploymentStageStats(BaseModel):
+    sample_size: int
+    stages: Dict[str, StageDurationStats]
+
+
 class Service(ServiceBase):
     id: int
     current_version: Optional[str] = None
     database_schema: Optional[str] = Field(None, alias="schema")
     created_at: datetime
     last_check_at: Optional[datetime] = None
-    deployments: List[Deployment] = []
+    # None unless the deployments were loaded (e.g. ?include=deployments)
+    deployments: Optional[List[Deployment]] = None
 
     class Config:
         orm_mode = True
         allow_population_by_field_name = True
+        getter_dict = LoadedRelationshipsGetter
+
+
+class ServiceBulkResult(BaseModel):
+    index: int
+    name: str
+    success: bool
+    service: Optional[Service] = None
+    error: Optional[str] = None
+
+
+class RolloutSelector(BaseModel):
+    # All given criteria must match; an empty selector matches every service
+    service_ids: Optional[List[int]] = None
+    name_prefix: Optional[str] = None
+    current_version: Optional[str] = None
+
+
+class RolloutCreate(BaseModel):
+    version: str
+    selector: RolloutSelector = RolloutSelector()
+    canary_size: int = Field(1, ge=0)
+    batch_size: int = Field(10, ge=1)
+    max_in_flight: int = Field(10, ge=1)
+    # Halt once more than this fraction of the finished deployments failed
+    max_failure_rate: float = Field(0.1, ge=0, le=1)
+
+
+class RolloutProgress(BaseModel):
+    id: str
+    version: str
+    status: str
+    wave: int
+    total_waves: int
+    total: int
+    skipped: int
+    dispatched: int
+    in_flight: int
+    succeeded: int
+    failed: int
+    failure_rate: float
+    halt_reason: Optional[str] = None
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+
+
+class HealthHistoryPoint(BaseModel):
+    # Start of the bucket, or time of the check for raw points
+    timestamp: datetime
+    checks: int
+    failures: int
+    avg_latency_ms: Optional[float] = None
+    # Raw points only
+    status_code: Optional[int] = None
+    # Last release/schema seen, and whether they changed within the bucket
+    release: Optional[str] = None
+    database_schema: Optional[str] = Field(None, alias="schema")
+    release_changed: bool = False
+    schema_changed: bool = False
+
+    class Config:
+        allow_population_by_field_name = True
+
+
+class HealthHistory(BaseModel):
+    service_id: int
+    resolution: str
+    start: datetime = Field(alias="from")
+    end: datetime = Field(alias="to")
+    points: List[HealthHistoryPoint]
+
+    class Config:
+        allow_population_by_field_name = True
 
 
 class HealthResponse(BaseModel):
@@ -68,3 +188,28 @@ class HealthResponse(BaseModel):
 
     class Config:
         allow_population_by_field_name = True
+
+
+class HealthFormatBase(BaseModel):
+    """
+    Field paths of a health response format, dotted for nested fields
+    (e.g. "service.database.schema_version")
+    """
+
+    name: str
+    release: str
+    database_schema: str = Field(alias="schema")
+    platform: Optional[str] = None
+    # Payloads without the platform path do not match the format
+    platform_required: bool = False
+
+    class Config:
+        allow_population_by_field_name = True
+
+
+class HealthFormatCreate(HealthFormatBase):
+    pass
+
+
+class HealthFormat(HealthFormatBase):
+    builtin: bool
@@ -1,59 +1,646 @@
-from typing import Dict, List
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, Hashable, Iterable, List, Optional, Set, Tuple
 
+import redis.asyncio as aioredis
 from fastapi import WebSocket, WebSocketDisconnect
+from redis.exceptions import RedisError
 
+from .metrics import WEBSOCKET_CONNECTIONS, WEBSOCKET_SEND_LATENCY
 
-class WebSocketManager:
+logger = logging.getLogger(__name__)
+
+
+class OverflowPolicy(str, Enum):
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+# Maximum number of messages waiting to be sent to one connection
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+# What to do when a connection's queue is full
+WS_OVERFLOW_POLICY = OverflowPolicy(
+    os.getenv("WS_OVERFLOW_POLICY", OverflowPolicy.DROP_OLDEST.value)
+)
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+# "redis" fans messages out to every API process, "local" keeps them in-process
+WS_BROADCAST_BACKEND = os.getenv("WS_BROADCAST_BACKEND", "redis").lower()
+WS_REDIS_URL = os.getenv("WS_REDIS_URL", f"redis://{REDIS_HOST}:6379/0")
+WS_EVENTS_CHANNEL = "websocket_events"
+# Seconds to wait before resubscribing after losing the Redis connection
+RESUBSCRIBE_DELAY = 5
+# Seconds during which the updates of one service are merged into one frame
+WS_COALESCE_WINDOW = float(os.getenv("WS_COALESCE_WINDOW", "0.25"))
+# Every Nth frame of a service is sent to everyone as a full keyframe
+WS_KEYFRAME_INTERVAL = int(os.getenv("WS_KEYFRAME_INTERVAL", "20"))
+if WS_KEYFRAME_INTERVAL < 1:
+    raise ValueError(
+        f"WS_KEYFRAME_INTERVAL must be at least 1, got {WS_KEYFRAME_INTERVAL}"
+    )
+# Close code sent to consumers disconnected for falling behind (try again later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+# Topics a connection can subscribe to
+ALL_TOPIC = "*"
+FLEET_TOPIC = "fleet"
+SERVICE_TOPIC_PREFIX = "service:"
+TYPE_TOPIC_PREFIX = "type:"
+SERVICE_UPDATE_EVENT = "service_updated"
+SERVICE_DELTA_EVENT = "service_delta"
+# Fleet-wide events, as opposed to events about a single service
+FLEET_EVENTS = {"services_created", "rollout_progress"}
+MAX_TOPICS_PER_CONNECTION = 1000
+
+
+def service_topic(service_id: int) -> str:
+    return f"{SERVICE_TOPIC_PREFIX}{service_id}"
+
+
+def is_valid_topic(topic: str) -> bool:
+    if topic in (ALL_TOPIC, FLEET_TOPIC):
+        return True
+    if topic.startswith(SERVICE_TOPIC_PREFIX):
+        return topic[len(SERVICE_TOPIC_PREFIX) :].isdigit()
+    return topic.startswith(TYPE_TOPIC_PREFIX) and len(topic) > len(TYPE_TOPIC_PREFIX)
+
+
+def event_topics(message: dict) -> Set[str]:
+    """
+    Topics whose subscribers receive a broadcast message: everything, its
+    event type, the services it is about and, for fleet-wide events, fleet
+    """
+    topics = {ALL_TOPIC, f"{TYPE_TOPIC_PREFIX}{message.get('type')}"}
+    if message.get("type") in FLEET_EVENTS:
+        topics.add(FLEET_TOPIC)
+    if message.get("service_id") is not None:
+        topics.add(service_topic(message["service_id"]))
+    service = message.get("service")
+    if isinstance(service, dict) and service.get("id") is not None:
+        topics.add(service_topic(service["id"]))
+    for service in message.get("services") or ():
+        if isinstance(service, dict) and service.get("id") is not None:
+            topics.add(service_topic(service["id"]))
+    return topics
+
+
+def coalesce_key(message: dict) -> Optional[Hashable]:
+    """
+    Messages with the same key describe the same entity, so a newer one
+    supersedes a queued older one. None means the message cannot be coalesced.
+    """
+    if message.get("type") == SERVICE_DELTA_EVENT:
+        # A delta only makes sense on top of the previous frame
+        return None
+    for field in ("deployment_id", "service_id"):
+        if message.get(field) is not None:
+            return message.get("type"), field, message[field]
+    for field in ("service", "rollout"):
+        entity = message.get(field)
+        if isinstance(entity, dict) and entity.get("id") is not None:
+            return message.get("type"), field, entity["id"]
+    return None
+
+
+class ConnectionWriter:
+    """
+    Bounded send queue of one connection, drained by its own writer task so
+    a slow client never delays the others or the code that broadcasts.
+    """
+
+    def __init__(
+        self,
+        manager: "WebSocketManager",
+        websocket: WebSocket,
+        max_size: int,
+        policy: OverflowPolicy,
+    ):
+        self.manager = manager
+        self.websocket = websocket
+        self.max_size = max_size
+        self.policy = policy
+        # (coalesce key, service of a coalescer frame, encoded message)
+        self.queue: Deque[Tuple[Optional[Hashable], Optional[int], str]] = deque()
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    def enqueue(
+        self, key: Optional[Hashable], text: str, service_id: Optional[int] = None
+    ):
+        if len(self.queue) >= self.max_size:
+            if self.policy == OverflowPolicy.DISCONNECT:
+                self.manager.slow_disconnects += 1
+                self.manager.disconnect(self.websocket)
+                asyncio.create_task(self._close())
+                return
+            if self.policy == OverflowPolicy.COALESCE and key is not None:
+                # Drop a superseded message of the same entity; the new one
+                # goes to the back so the client never sees older state last
+                index = next(
+                    (i for i, (queued, _, _) in enumerate(self.queue) if queued == key),
+                    None,
+                )
+                if index is not None:
+                    self._lost(self.queue[index])
+                    del self.queue[index]
+                    self.manager.coalesced += 1
+            if len(self.queue) >= self.max_size:
+                self._lost(self.queue.popleft())
+                self.manager.dropped += 1
+        self.queue.append((key, service_id, text))
+        self._ready.set()
+
+    def _lost(self, entry: Tuple[Optional[Hashable], Optional[int], str]):
+        # The client will not get this frame, so its next one must not be a
+        # delta on top of it
+        service_id = entry[1]
+        if service_id is not None:
+            self.manager.coalescer.lost(self.websocket, service_id)
+
+    def cancel(self):
+        self._task.cancel()
+
+    async def run(self):
+        while True:
+            await self._ready.wait()
+            while self.queue:
+                _, _, text = self.queue.popleft()
+                started = time.perf_counter()
+                try:
+                    await self.websocket.send_text(text)
+                except Exception as e:
+                    if not isinstance(e, WebSocketDisconnect):
+                        logger.warning("Error sending WebSocket message: %s", e)
+                    self.manager.disconnect(self.websocket)
+                    return
+                WEBSOCKET_SEND_LATENCY.observe(time.perf_counter() - started)
+                self.manager.sent += 1
+            self._ready.clear()
+
+    async def _close(self):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+
+class RedisBroadcastBackend:
+    """
+    Publishes messages on a Redis channel that every API process subscribes
+    to, so each process delivers them to its own connections. A process only
+    publishes while its own subscription is up; otherwise the manager
+    delivers locally, so a Redis outage degrades to single-process fan-out.
+    """
+
+    def __init__(
+        self,
+        manager: "WebSocketManager",
+        url: str = WS_REDIS_URL,
+        channel: str = WS_EVENTS_CHANNEL,
+    ):
+        self.manager = manager
+        self.url = url
+        self.channel = channel
+        self.redis: Optional[aioredis.Redis] = None
+        self.subscribed = False
+        self.published = 0
+        self.errors = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self.redis = aioredis.from_url(
+                self.url, socket_connect_timeout=1, socket_timeout=1
+            )
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    async def publish(self, topics: Optional[List[str]], message: dict) -> bool:
+        """
+        Returns False if the message was not published and must be
+        delivered locally
+        """
+        if not self.subscribed or self.redis is None:
+            return False
+        try:
+            await self.redis.publish(
+                self.channel,
+                json.dumps(
+                    {"topics": topics, "message": message},
+                    separators=(",", ":"),
+                    ensure_ascii=False,
+                ),
+            )
+        except RedisError as e:
+            self.errors += 1
+            logger.warning("WebSocket broadcast publish failed: %s", e)
+            return False
+        self.published += 1
+        return True
+
+    async def run(self):
+        while True:
+            # Subscriptions block on reads, so they get their own connection
+            redis = aioredis.from_url(self.url)
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.subscribed = True
+                async for event in pubsub.listen():
+                    if event["type"] != "message":
+                        continue
+                    try:
+                        envelope = json.loads(event["data"])
+                        self.manager.deliver(envelope["message"], envelope["topics"])
+                    except Exception:
+                        logger.exception("Failed to deliver WebSocket event")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning("WebSocket broadcast subscriber error: %s", e)
+            finally:
+                self.subscribed = False
+                await pubsub.reset()
+                await redis.close()
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+
+def encode_message(message: dict) -> str:
+    # Same encoding as send_json
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class ServiceStream:
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.connection_mapping: Dict[int, List[WebSocket]] = {}
+        # Last state sent, its sequence number, and updates not sent yet
+        self.state: Dict = {}
+        self.seq = 0
+        self.pending: Dict = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class ServiceUpdateCoalescer:
+    """
+    Merges the service_updated events of each service over a short window
+    and sends a frame with only the fields that changed since the previous
+    one. Frames carry a per-service sequence number: a connection that did
+    not get the previous frame (a new subscriber, or one whose queue dropped
+    a frame of the service) receives a full keyframe instead, and every
+    keyframe_interval frames everyone does. A client that sees a gap in the
+    sequence sends {"action": "resync", "topics": ["service:<id>"]} to get a
+    keyframe.
+    """
+
+    def __init__(
+        self,
+        manager: "WebSocketManager",
+        window: float = WS_COALESCE_WINDOW,
+        keyframe_interval: int = WS_KEYFRAME_INTERVAL,
+    ):
+        self.manager = manager
+        self.window = window
+        self.keyframe_interval = keyframe_interval
+        self.streams: Dict[int, ServiceStream] = {}
+        # connection -> service_id -> sequence number of the last frame queued
+        self.last_seq: Dict[WebSocket, Dict[int, int]] = {}
+        self.merged = 0
+        self.deltas = 0
+        self.keyframes = 0
+
+    def add(self, service: dict):
+        service_id = service["id"]
+        stream = self.streams.setdefault(service_id, ServiceStream())
+        if stream.pending:
+            self.merged += 1
+        stream.pending.update(service)
+        if stream.timer is not None:
+            return
+        if self.window > 0:
+            stream.timer = asyncio.get_running_loop().call_later(
+                self.window, self.flush, service_id
+            )
+        else:
+            self.flush(service_id)
+
+    def flush(self, service_id: int):
+        stream = self.streams[service_id]
+        stream.timer = None
+        changes = {
+            field: value
+            for field, value in stream.pending.items()
+            if field not in stream.state or stream.state[field] != value
+        }
+        stream.pending = {}
+        if not changes:
+            return
+        stream.state.update(changes)
+        stream.seq += 1
+
+        recipients = self.manager.recipients(
+            {
+                ALL_TOPIC,
+                f"{TYPE_TOPIC_PREFIX}{SERVICE_UPDATE_EVENT}",
+                service_topic(service_id),
+            }
+        )
+        keyframe_due = stream.seq % self.keyframe_interval == 0
+        delta_text = keyframe_text = keyframe_key = None
+        for connection in recipients:
+            seen = self.last_seq.setdefault(connection, {})
+            delta = not keyframe_due and seen.get(service_id) == stream.seq - 1
+            # Recorded before queueing: a frame dropped from the queue, this
+            # one included, clears it again
+            seen[service_id] = stream.seq
+            if delta:
+                if delta_text is None:
+                    delta_text = encode_message(
+                        {
+                            "type": SERVICE_DELTA_EVENT,
+                            "service_id": service_id,
+                            "seq": stream.seq,
+                            "changes": changes,
+                        }
+                    )
+                self.manager.enqueue_text([connection], None, delta_text, service_id)
+                self.deltas += 1
+            else:
+                if keyframe_text is None:
+                    keyframe = self._keyframe(stream)
+                    keyframe_key = coalesce_key(keyframe)
+                    keyframe_text = encode_message(keyframe)
+                self.manager.enqueue_text(
+                    [connection], keyframe_key, keyframe_text, service_id
+                )
+                self.keyframes += 1
+
+    def resync(self, websocket: WebSocket, service_ids: Iterable[int]):
+        seen = self.last_seq.setdefault(websocket, {})
+        for service_id in service_ids:
+            stream = self.streams.get(service_id)
+            if stream is None or not stream.seq:
+                continue
+            keyframe = self._keyframe(stream)
+            seen[service_id] = stream.seq
+            self.manager.enqueue_text(
+                [websocket],
+                coalesce_key(keyframe),
+                encode_message(keyframe),
+                service_id,
+            )
+            self.keyframes += 1
+
+    def lost(self, websocket: WebSocket, service_id: int):
+        """
+        Called when a frame of the service was dropped from the connection's
+        queue: its next frame of that service is a keyframe
+        """
+        seen = self.last_seq.get(websocket)
+        if seen is not None:
+            seen.pop(service_id, None)
+
+    def forget(self, websocket: WebSocket):
+        self.last_seq.pop(websocket, None)
+
+    @staticmethod
+    def _keyframe(stream: ServiceStream) -> dict:
+        return {
+            "type": SERVICE_UPDATE_EVENT,
+            "service": stream.state,
+            "seq": stream.seq,
+            "keyframe": True,
+        }
+
 
-    async def connect(self, websocket: WebSocket, service_id: int = None):
+class WebSocketManager:
+    """
+    Tracks connections and their topic subscriptions in two set-based
+    indexes (topic -> connections and connection -> topics), so a message
+    only reaches interested connections and a disconnect only touches the
+    connection's own topics.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        overflow_policy: OverflowPolicy = WS_OVERFLOW_POLICY,
+        backend: str = WS_BROADCAST_BACKEND,
+        coalesce_window: float = WS_COALESCE_WINDOW,
+        keyframe_interval: int = WS_KEYFRAME_INTERVAL,
+    ):
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.backend: Optional[RedisBroadcastBackend] = (
+            RedisBroadcastBackend(self) if backend == "redis" else None
+        )
+        self.active_connections: Set[WebSocket] = set()
+        self.topic_connections: Dict[str, Set[WebSocket]] = {}
+        self.connection_topics: Dict[WebSocket, Set[str]] = {}
+        self.writers: Dict[WebSocket, ConnectionWriter] = {}
+        self.coalescer = ServiceUpdateCoalescer(
+            self, coalesce_window, keyframe_interval
+        )
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+
+    def start(self):
+        if self.backend is not None:
+            self.backend.start()
+
+    async def stop(self):
+        if self.backend is not None:
+            await self.backend.stop()
+
+    async def connect(self, websocket: WebSocket, topics: Iterable[str] = ()):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        if service_id is not None:
-            if service_id not in self.connection_mapping:
-                self.connection_mapping[service_id] = []
-            self.connection_mapping[service_id].append(websocket)
+        self.active_connections.add(websocket)
+        WEBSOCKET_CONNECTIONS.inc()
+        self.connection_topics[websocket] = set()
+        self.writers[websocket] = ConnectionWriter(
+            self, websocket, self.queue_size, self.overflow_policy
+        )
+        self.subscribe(websocket, topics)
 
-    def disconnect(self, websocket: WebSocket, service_id: int = None):
+    def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
-        if service_id and service_id in self.connection_mapping:
-            if websocket in self.connection_mapping[service_id]:
-                self.connection_mapping[service_id].remove(websocket)
-            if not self.connection_mapping[service_id]:
-                del self.connection_mapping[service_id]
+            WEBSOCKET_CONNECTIONS.dec()
+        writer = self.writers.pop(websocket, None)
+        if writer is not None:
+            writer.cancel()
+        self.unsubscribe(websocket, self.connection_topics.pop(websocket, ()))
+        self.coalescer.forget(websocket)
+
+    def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        """
+        Subscribes a connection to the valid topics among topics and returns
+        the rejected ones
+        """
+        subscribed = self.connection_topics.get(websocket)
+        if subscribed is None:
+            return list(topics)
+        rejected = []
+        for topic in topics:
+            if not is_valid_topic(topic) or (
+                topic not in subscribed and len(subscribed) >= MAX_TOPICS_PER_CONNECTION
+            ):
+                rejected.append(topic)
+                continue
+            subscribed.add(topic)
+            self.topic_connections.setdefault(topic, set()).add(websocket)
+        return rejected
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        subscribed = self.connection_topics.get(websocket)
+        for topic in list(topics):
+            if subscribed is not None:
+                subscribed.discard(topic)
+            connections = self.topic_connections.get(topic)
+            if connections is None:
+                continue
+            connections.discard(websocket)
+            if not connections:
+                del self.topic_connections[topic]
+
+    def handle_message(self, websocket: WebSocket, data: str):
+        """
+        Applies a client message of the subscription protocol:
+        {"action": "subscribe" | "unsubscribe" | "resync", "topics": [...]}.
+        Replies with the connection's subscriptions, the requested
+        keyframes, or an error.
+        """
+        try:
+            request = json.loads(data)
+            action = request["action"]
+            topics = [str(topic) for topic in request["topics"]]
+        except (ValueError, KeyError, TypeError):
+            self.send(
+                websocket,
+                {
+                    "type": "error",
+                    "detail": 'Expected {"action": "subscribe" | "unsubscribe" '
+                    '| "resync", "topics": [...]}',
+                },
+            )
+            return
+
+        rejected: List[str] = []
+        if action == "subscribe":
+            rejected = self.subscribe(websocket, topics)
+        elif action == "unsubscribe":
+            self.unsubscribe(websocket, topics)
+        elif action == "resync":
+            self.coalescer.resync(
+                websocket,
+                [
+                    int(topic[len(SERVICE_TOPIC_PREFIX) :])
+                    for topic in topics
+                    if topic.startswith(SERVICE_TOPIC_PREFIX) and is_valid_topic(topic)
+                ],
+            )
+            return
+        else:
+            self.send(
+                websocket, {"type": "error", "detail": f"Unknown action: {action}"}
+            )
+            return
+        reply = {
+            "type": "subscriptions",
+            "topics": sorted(self.connection_topics.get(websocket, ())),
+        }
+        if rejected:
+            reply["rejected"] = rejected
+        self.send(websocket, reply)
 
     async def broadcast(self, message: dict):
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except WebSocketDisconnect:
-                disconnected.append(connection)
-            except Exception as e:
-                print(f"Error broadcasting message: {str(e)}")
-                disconnected.append(connection)
+        """
+        Queues the message for every subscribed connection, in every process
+        when the Redis backend is up, and returns without waiting for the sends
+        """
+        if self.backend is None or not await self.backend.publish(None, message):
+            self.deliver(message)
 
-        for connection in disconnected:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
+    def deliver(self, message: dict, topics: Optional[Iterable[str]] = None):
+        """
+        Queues the message for this process's connections subscribed to any
+        of topics (by default, the topics of the event)
+        """
+        if topics is None:
+            service = message.get("service")
+            if message.get("type") == SERVICE_UPDATE_EVENT and isinstance(
+                service, dict
+            ):
+                self.coalescer.add(service)
+                return
+            topics = event_topics(message)
+        recipients = self.recipients(topics)
+        if recipients:
+            self._enqueue(recipients, message)
 
-    async def send_service_update(self, service_id: int, message: dict):
-        if service_id in self.connection_mapping:
-            disconnected = []
-            for connection in self.connection_mapping[service_id]:
-                try:
-                    await connection.send_json(message)
-                except WebSocketDisconnect:
-                    disconnected.append(connection)
-                except Exception as e:
-                    print(f"Error sending service update: {str(e)}")
-                    disconnected.append(connection)
+    def recipients(self, topics: Iterable[str]) -> Set[WebSocket]:
+        connections: Set[WebSocket] = set()
+        for topic in topics:
+            connections.update(self.topic_connections.get(topic, ()))
+        return connections
+
+    def send(self, websocket: WebSocket, message: dict):
+        """
+        Queues a message for a single connection
+        """
+        self._enqueue([websocket], message)
+
+    def _enqueue(self, connections: Iterable[WebSocket], message: dict):
+        # Encoded once for all connections
+        self.enqueue_text(connections, coalesce_key(message), encode_message(message))
+
+    def enqueue_text(
+        self,
+        connections: Iterable[WebSocket],
+        key: Optional[Hashable],
+        text: str,
+        service_id: Optional[int] = None,
+    ):
+        for connection in list(connections):
+            writer = self.writers.get(connection)
+            if writer is not None:
+                writer.enqueue(key, text, service_id)
 
-            for connection in disconnected:
-                self.disconnect(connection, service_id)
+    def stats(self) -> Dict[str, int]:
+        depths = [len(writer.queue) for writer in self.writers.values()]
+        return {
+            "connections": len(self.active_connections),
+            "topics": len(self.topic_connections),
+            "queue_depth": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "merged_updates": self.coalescer.merged,
+            "delta_frames": self.coalescer.deltas,
+            "keyframes": self.coalescer.keyframes,
+            "published": self.backend.published if self.backend else 0,
+            "backend_errors": self.backend.errors if self.backend else 0,
+        }
 
 
 manager = WebSocketManager()
@@ -0,0 +1,59 @@
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+
+parser = argparse.ArgumentParser(
+    prog="python -m benchmarks",
+    description="Offline API benchmarks; writes a JSON report to diff between releases",
+)
+parser.add_argument("--output", default="benchmark-report.json")
+parser.add_argument(
+    "--requests", type=int, default=500, help="Measured requests per HTTP scenario"
+)
+parser.add_argument(
+    "--concurrency", type=int, default=10, help="Requests in flight at once"
+)
+parser.add_argument(
+    "--broadcasts", type=int, default=100, help="Broadcasts per fan-out size"
+)
+parser.add_argument(
+    "--warmup", type=int, default=20, help="Unmeasured requests per scenario"
+)
+args = parser.parse_args()
+
+# Everything the app would reach over the network is replaced before it is
+# imported: SQLite for MySQL (unless DATABASE_URL points at a throwaway
+# database), no response cache, pollers, archival or event listeners,
+# in-process WebSocket fan-out
+workdir = tempfile.mkdtemp(prefix="benchmarks-")
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/benchmark.db"
+    os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir}/benchmark.db"
+for name, value in {
+    "CACHE_ENABLED": "false",
+    "HEALTH_POLL_ENABLED": "false",
+    "HEALTH_HISTORY_ENABLED": "false",
+    "ARCHIVE_ENABLED": "false",
+    "DEPLOYMENT_EVENTS_ENABLED": "false",
+    "LEADER_ELECTION_ENABLED": "false",
+    "WS_BROADCAST_BACKEND": "local",
+    "LOG_LEVEL": "WARNING",
+}.items():
+    os.environ.setdefault(name, value)
+
+from .suite import run  # noqa: E402
+
+try:
+    asyncio.run(
+        run(
+            output=args.output,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            broadcasts=args.broadcasts,
+            warmup=args.warmup,
+        )
+    )
+finally:
+    shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,98 @@
+"""
+Per-payload parse cost of every health format, through its compiled parser
+and through AUTO detection (fingerprint cache hit, and a cold detection that
+tries the formats in order):
+
+    python -m benchmarks.formats [--iterations N] [--output formats.json]
+"""
+
+import argparse
+import json
+import timeit
+
+from app.health_formats import FormatMapping, format_registry
+from app.health_service import FormatDetector
+
+# A format registered at runtime, with deeper paths than the built-ins
+NESTED_FORMAT = FormatMapping(
+    "bench-nested",
+    release="meta.build.release",
+    schema="meta.storage.schema.version",
+    platform="meta.runtime.name",
+    platform_required=True,
+)
+
+PAYLOADS = {
+    "standard": {"platform": "3.12.3", "release": "1.4.2", "schema": "schema_1_4"},
+    "lifemote": {"release": "1.4.2", "schema": "schema_1_4", "uptime": 86400},
+    "simple": {"version": "1.4.2", "db_version": "schema_1_4"},
+    "detailed": {
+        "service": {
+            "version": "1.4.2",
+            "platform_version": "3.12.3",
+            "database": {"schema_version": "schema_1_4"},
+        }
+    },
+    "legacy": {"app_version": "1.4.2", "db": "schema_1_4", "runtime": "3.12.3"},
+    NESTED_FORMAT.name: {
+        "meta": {
+            "build": {"release": "1.4.2"},
+            "storage": {"schema": {"version": "schema_1_4"}},
+            "runtime": {"name": "3.12.3"},
+        }
+    },
+}
+
+
+def per_call_ns(call, iterations: int) -> float:
+    # Best of 5 runs, to keep scheduler noise out of the comparison
+    best = min(timeit.repeat(call, number=iterations, repeat=5))
+    return round(best / iterations * 1e9, 1)
+
+
+def run(iterations: int) -> dict:
+    format_registry.register(NESTED_FORMAT)
+    detector = FormatDetector()
+    results = {}
+    for name, payload in PAYLOADS.items():
+        parser = format_registry.parsers[name]
+        assert parser(payload) is not None, name
+        assert detector.detect_and_parse(payload)[0] == name, name
+        results[name] = {
+            "compiled_ns": per_call_ns(lambda: parser(payload), iterations),
+            "auto_cached_ns": per_call_ns(
+                lambda: detector.detect_and_parse(payload), iterations
+            ),
+            "auto_cold_ns": per_call_ns(
+                lambda: FormatDetector().detect_and_parse(payload), iterations
+            ),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.formats")
+    parser.add_argument("--iterations", type=int, default=20_000)
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+    print(f"{'format':<14}{'compiled':>12}{'auto cached':>14}{'auto cold':>12}  (ns)")
+    for name, timings in results.items():
+        print(
+            f"{name:<14}{timings['compiled_ns']:>12}"
+            f"{timings['auto_cached_ns']:>14}{timings['auto_cold_ns']:>12}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"iterations": args.iterations, "results": results},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
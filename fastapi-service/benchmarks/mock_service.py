@@ -0,0 +1,80 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+INITIAL_INFO = {"platform": "3.12.3", "release": "1.0.0", "schema": "initial_schema"}
+
+
+class MockServiceHandler(BaseHTTPRequestHandler):
+    """
+    Same endpoints as mock-service, but with one state per path prefix:
+    /<name>/api/health/info is the health endpoint of service <name>, so every
+    benchmarked service can be deployed independently
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def _service(self) -> str:
+        return self.path.split("/api/", 1)[0]
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if not self.path.endswith("/api/health/info"):
+            self._reply(404, {"error": "Not found"})
+            return
+        with self.server.lock:
+            info = self.server.services.get(self._service(), INITIAL_INFO)
+        self._reply(200, info)
+
+    def do_POST(self):
+        if not self.path.endswith("/api/update"):
+            self._reply(404, {"error": "Not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            info = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._reply(400, {"error": "Invalid request body"})
+            return
+        with self.server.lock:
+            self.server.services[self._service()] = info
+        self._reply(
+            200, {"status": "success", "message": "Service updated successfully"}
+        )
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockService:
+    """
+    In-process stand-in for mock-service, served from a background thread on
+    a free local port
+    """
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockServiceHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.services: Dict[str, dict] = {}
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
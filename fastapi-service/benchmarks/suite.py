@@ -0,0 +1,327 @@
+"""
+Benchmark scenarios. The app is served by uvicorn on a local port, in the
+same event loop as the clients, so requests go through the real HTTP and
+WebSocket stacks without leaving the machine.
+"""
+
+import asyncio
+import json
+import platform
+import socket
+import subprocess
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
+
+import fakeredis
+import httpx
+import sqlalchemy
+import uvicorn
+import websockets
+from sqlalchemy import delete, insert
+
+from app import celery_app as celery_module
+from app import models
+from app.celery_app import celery_app
+from app.database import SQLALCHEMY_DATABASE_URL, SessionLocal
+from app.main import MAX_PAGE_SIZE, NEXT_PAGE_HEADER, app
+from app.readiness import readiness
+from app.websocket import manager
+
+from .mock_service import MockService
+
+LIST_SERVICES_ROWS = (10, 1_000, 10_000)
+FANOUT_CLIENTS = (1, 100, 1_000)
+# Deployments created up front for the status scenario
+DEPLOYMENTS = 200
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    # Nearest-rank percentile of an already sorted sample
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> dict:
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"count": 0, "errors": errors}
+
+    def ms(seconds: float) -> float:
+        return round(seconds * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "throughput_per_second": round(len(ordered) / elapsed, 1),
+        "mean_ms": ms(sum(ordered) / len(ordered)),
+        "p50_ms": ms(percentile(ordered, 0.50)),
+        "p90_ms": ms(percentile(ordered, 0.90)),
+        "p99_ms": ms(percentile(ordered, 0.99)),
+        "max_ms": ms(ordered[-1]),
+    }
+
+
+async def measure(
+    call: Callable[[int], Awaitable[httpx.Response]],
+    requests: int,
+    concurrency: int,
+    warmup: int = 0,
+) -> dict:
+    """
+    Runs call(0..requests-1) with `concurrency` calls in flight. Warmup calls
+    are made first, sequentially, with negative indexes and are not measured.
+    """
+    for index in range(-warmup, 0):
+        (await call(index)).raise_for_status()
+
+    latencies: List[float] = []
+    errors = 0
+    indexes = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in indexes:
+            started = time.perf_counter()
+            try:
+                (await call(index)).raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def reset_database():
+    with SessionLocal() as db:
+        db.execute(delete(models.Deployment))
+        db.execute(delete(models.Service))
+        db.commit()
+
+
+def seed_services(count: int, base_url: str, prefix: str = "seed") -> List[int]:
+    rows = [
+        {
+            "name": f"{prefix}-{index}",
+            "url": f"{base_url}/{prefix}-{index}",
+            "healthEndpoint": "/api/health/info",
+            "response_format": models.ResponseFormat.STANDARD.value,
+            "current_version": "1.0.0",
+            "database_schema": "initial_schema",
+            "created_at": datetime.utcnow(),
+        }
+        for index in range(count)
+    ]
+    with SessionLocal() as db:
+        for start in range(0, count, 1000):
+            db.execute(insert(models.Service), rows[start : start + 1000])
+        db.commit()
+        return list(
+            db.scalars(
+                sqlalchemy.select(models.Service.id)
+                .where(models.Service.name.startswith(f"{prefix}-"))
+                .order_by(models.Service.id)
+            )
+        )
+
+
+async def bench_create_service(client, mock, requests, concurrency, warmup) -> dict:
+    reset_database()
+
+    async def create(index: int) -> httpx.Response:
+        name = f"create-{index}"
+        return await client.post(
+            "/services/",
+            json={
+                "name": name,
+                "url": f"{mock.url}/{name}",
+                "healthEndpoint": "/api/health/info",
+                "responseFormat": "standard",
+            },
+        )
+
+    return await measure(create, requests, concurrency, warmup)
+
+
+async def list_all_services(client: httpx.AsyncClient) -> httpx.Response:
+    """
+    Lists every service, following the next-page header with the largest
+    page size, and returns the last page's response (or the first error)
+    """
+    params = {"limit": MAX_PAGE_SIZE}
+    while True:
+        response = await client.get("/services/", params=params)
+        after_id = response.headers.get(NEXT_PAGE_HEADER)
+        if response.is_error or after_id is None:
+            return response
+        params = {"limit": MAX_PAGE_SIZE, "after_id": after_id}
+
+
+async def bench_list_services(client, mock, requests, concurrency, warmup) -> dict:
+    # One measured call is the full listing, so latency grows with the rows
+    results = {}
+    for rows in LIST_SERVICES_ROWS:
+        reset_database()
+        seed_services(rows, mock.url)
+        results[f"rows={rows}"] = await measure(
+            lambda index: list_all_services(client), requests, concurrency, warmup
+        )
+    return results
+
+
+async def bench_deployment_status(client, mock, requests, concurrency, warmup):
+    """
+    `resolve`: first status request of a deployment, which reads the Celery
+    result and completes the row. `completed`: later requests, answered from
+    the database.
+    """
+    reset_database()
+    service_ids = seed_services(DEPLOYMENTS, mock.url, prefix="deploy")
+    deployment_ids = []
+    for service_id in service_ids:
+        response = await client.post(
+            f"/services/{service_id}/deployments/", json={"version": "1.1.0"}
+        )
+        response.raise_for_status()
+        deployment_ids.append(response.json()["id"])
+
+    def status(index: int) -> Awaitable[httpx.Response]:
+        deployment_id = deployment_ids[index % len(deployment_ids)]
+        return client.get(f"/deployments/{deployment_id}/status")
+
+    return {
+        "resolve": await measure(status, len(deployment_ids), concurrency),
+        "completed": await measure(status, requests, concurrency, warmup),
+    }
+
+
+async def bench_websocket_fanout(url: str, broadcasts: int) -> dict:
+    """
+    Latency from manager.broadcast() until every connected client has
+    received the event
+    """
+    results = {}
+    for clients in FANOUT_CLIENTS:
+        connections = await asyncio.gather(
+            *(websockets.connect(url, max_queue=None) for _ in range(clients))
+        )
+        while len(manager.active_connections) < clients:
+            await asyncio.sleep(0.01)
+
+        latencies = []
+        started = time.perf_counter()
+        for seq in range(broadcasts):
+            sent = time.perf_counter()
+            await manager.broadcast({"type": "benchmark", "seq": seq})
+            await asyncio.gather(*(connection.recv() for connection in connections))
+            latencies.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - started
+
+        await asyncio.gather(*(connection.close() for connection in connections))
+        while manager.active_connections:
+            await asyncio.sleep(0.01)
+
+        summary = summarize(latencies, elapsed)
+        summary["messages_per_second"] = round(clients * broadcasts / elapsed, 1)
+        results[f"clients={clients}"] = summary
+    return results
+
+
+def environment() -> Dict[str, str]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": SQLALCHEMY_DATABASE_URL.split(":", 1)[0],
+        "sqlalchemy": sqlalchemy.__version__,
+    }
+
+
+async def run(
+    output: str, requests: int, concurrency: int, broadcasts: int, warmup: int
+):
+    # Deployments run inline; their results land in an in-memory result
+    # backend and their checkpoints in an in-memory Redis
+    celery_app.conf.update(
+        task_always_eager=True,
+        task_store_eager_result=True,
+        result_backend="cache+memory://",
+    )
+    celery_module._redis = fakeredis.FakeRedis()
+
+    mock = MockService()
+    mock.start()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    host, port = sock.getsockname()
+    server = uvicorn.Server(
+        uvicorn.Config(
+            app,
+            lifespan="on",
+            ws="websockets",
+            log_config=None,
+            access_log=False,
+            backlog=2048,
+        )
+    )
+    serving = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+    # The schema is created by the app's startup phase, in the background
+    if not await readiness.wait():
+        raise RuntimeError(f"API startup failed: {readiness.error}")
+
+    results = {}
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://{host}:{port}",
+            timeout=30,
+            limits=httpx.Limits(max_connections=concurrency),
+        ) as client:
+            for name, scenario in (
+                ("create_service", bench_create_service),
+                ("list_services", bench_list_services),
+                ("get_deployment_status", bench_deployment_status),
+            ):
+                print(f"Running {name}...", flush=True)
+                results[name] = await scenario(
+                    client, mock, requests, concurrency, warmup
+                )
+        print("Running websocket_fanout...", flush=True)
+        results["websocket_fanout"] = await bench_websocket_fanout(
+            f"ws://{host}:{port}/ws", broadcasts
+        )
+    finally:
+        server.should_exit = True
+        await serving
+        mock.stop()
+
+    report = {
+        "generated_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": {
+            "requests": requests,
+            "concurrency": concurrency,
+            "broadcasts": broadcasts,
+            "warmup": warmup,
+        },
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Report written to {output}")
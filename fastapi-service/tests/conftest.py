@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+import redis.asyncio as aioredis
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """
+    In-memory stand-in for Redis: every client the app creates, whatever its
+    URL, talks to the same fake server
+    """
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        aioredis,
+        "from_url",
+        lambda url, **kwargs: fakeredis.aioredis.FakeRedis(server=server),
+    )
+    return server
+
+
+async def wait_for(condition, timeout: float = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        await asyncio.sleep(0.01)
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.auth.cache import JWKSCache, VerifiedTokenCache, stop_jwks_caches
+
+
+def signing_key(kid: str) -> dict:
+    return {"kty": "RSA", "kid": kid, "n": f"modulus-{kid}", "e": "AQAB", "use": "sig"}
+
+
+class JWKSHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        payload = json.dumps({"keys": self.server.keys}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def jwks_server():
+    """
+    Local stand-in for Auth0's JWKS endpoint, serving server.keys
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JWKSHandler)
+    server.keys = [signing_key("k1")]
+    server.requests = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/.well-known/jwks.json"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.anyio
+async def test_unknown_kid_refetches_rotated_keys(jwks_server):
+    jwks = JWKSCache(jwks_server.url, ttl=3600, min_refetch_interval=0)
+    try:
+        assert (await jwks.get_key("k1"))["n"] == "modulus-k1"
+        assert jwks_server.requests == 1
+
+        # Known kids are served from memory
+        await jwks.get_key("k1")
+        assert jwks_server.requests == 1
+
+        jwks_server.keys = [signing_key("k2")]
+        assert (await jwks.get_key("k2"))["n"] == "modulus-k2"
+        assert jwks_server.requests == 2
+        assert await jwks.get_key("k1") is None
+    finally:
+        await jwks.stop()
+
+
+@pytest.mark.anyio
+async def test_unknown_kids_refetch_at_most_once_per_interval(jwks_server):
+    jwks = JWKSCache(jwks_server.url, ttl=3600, min_refetch_interval=60)
+    try:
+        await jwks.get_key("k1")
+        for kid in ("made-up-1", "made-up-2"):
+            assert await jwks.get_key(kid) is None
+        assert jwks_server.requests == 1
+    finally:
+        await jwks.stop()
+
+
+@pytest.mark.anyio
+async def test_concurrent_lookups_share_one_fetch(jwks_server):
+    jwks = JWKSCache(jwks_server.url, ttl=3600, min_refetch_interval=0)
+    try:
+        keys = await asyncio.gather(*(jwks.get_key("k1") for _ in range(10)))
+        assert all(key["kid"] == "k1" for key in keys)
+        assert jwks_server.requests == 1
+    finally:
+        await jwks.stop()
+
+
+@pytest.mark.anyio
+async def test_stop_jwks_caches_cancels_refreshers(jwks_server):
+    jwks = JWKSCache(jwks_server.url, ttl=3600, min_refetch_interval=0)
+    await jwks.get_key("k1")
+    refresher = jwks._refresher
+    await stop_jwks_caches()
+    assert refresher.cancelled()
+    assert jwks._refresher is None
+
+
+def test_verified_token_served_until_exp():
+    tokens = VerifiedTokenCache(max_entries=10)
+    claims = {"sub": "user", "exp": time.time() + 60}
+    tokens.set("valid", claims)
+    assert tokens.get("valid") == claims
+
+    tokens.set("expired", {"sub": "user", "exp": time.time() - 1})
+    assert tokens.get("expired") is None
+    # Expired entries are dropped on access
+    assert tokens.get("expired") is None
+    assert (tokens.hits, tokens.misses) == (1, 2)
+
+
+def test_tokens_without_exp_are_not_cached():
+    tokens = VerifiedTokenCache(max_entries=10)
+    tokens.set("no-exp", {"sub": "user"})
+    assert tokens.get("no-exp") is None
+
+
+def test_least_recently_used_token_is_evicted():
+    tokens = VerifiedTokenCache(max_entries=2)
+    exp = time.time() + 60
+    for token in ("a", "b"):
+        tokens.set(token, {"sub": token, "exp": exp})
+    tokens.get("a")
+    tokens.set("c", {"sub": "c", "exp": exp})
+    assert tokens.get("b") is None
+    assert tokens.get("a") is not None
+    assert tokens.get("c") is not None
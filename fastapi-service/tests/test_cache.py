@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from app.cache import ResponseCache
+
+
+@pytest.fixture
+async def cache(redis_server):
+    cache = ResponseCache(enabled=True, failure_cooldown=0.2)
+    yield cache
+    await cache.close()
+
+
+@pytest.mark.anyio
+async def test_redis_is_skipped_for_a_cooldown_after_an_error(cache, redis_server):
+    redis_server.connected = False
+    assert await cache.get_version() is None
+    assert cache.stats()["errors"] == 1
+
+    # Within the cooldown, reads bypass Redis without trying it
+    assert await cache.get_version(1) is None
+    await cache.set("cache:key", b"{}", {})
+    assert (cache.stats()["errors"], cache.stats()["skipped"]) == (1, 2)
+
+    redis_server.connected = True
+    await asyncio.sleep(0.25)
+    assert await cache.get_version() == 0
+
+
+@pytest.mark.anyio
+async def test_bumps_are_attempted_during_the_cooldown(cache, redis_server):
+    redis_server.connected = False
+    assert await cache.get_version() is None
+
+    redis_server.connected = True
+    await cache.bump([1])
+    assert cache.stats()["errors"] == 1
+    await asyncio.sleep(0.25)
+    assert await cache.get_version(1) == 1
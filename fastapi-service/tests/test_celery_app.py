@@ -0,0 +1,24 @@
+import httpx
+import pytest
+
+from app.celery_app import DeploymentFailed, DeploymentStage, is_retryable
+
+request = httpx.Request("POST", "http://service/api/update")
+
+
+@pytest.mark.parametrize(
+    "stage, error, retryable",
+    [
+        (DeploymentStage.PRECHECK, httpx.ReadTimeout("", request=request), True),
+        (DeploymentStage.VERIFY, httpx.RemoteProtocolError("", request=request), True),
+        # The update may have been applied before the response was lost
+        (DeploymentStage.UPDATE, httpx.ReadTimeout("", request=request), False),
+        (DeploymentStage.UPDATE, httpx.RemoteProtocolError("", request=request), False),
+        # ...but not if it never reached the service
+        (DeploymentStage.UPDATE, httpx.ConnectError("", request=request), True),
+        (DeploymentStage.UPDATE, httpx.ConnectTimeout("", request=request), True),
+        (DeploymentStage.PRECHECK, DeploymentFailed("Invalid version upgrade"), False),
+    ],
+)
+def test_only_safe_stage_failures_are_retried(stage, error, retryable):
+    assert is_retryable(stage, error) is retryable
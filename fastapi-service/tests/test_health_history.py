@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+from app.health_history import HealthHistory, HealthSample, Resolution
+
+
+@pytest.fixture
+async def history(redis_server):
+    history = HealthHistory(enabled=True)
+    yield history
+    await history.close()
+
+
+@pytest.mark.anyio
+async def test_rollups_aggregate_each_bucket(history):
+    # Two minutes on either side of a day boundary
+    day = int(time.time() // 86400 * 86400)
+    samples = [
+        HealthSample(1, day - 50, True, 200, 10.0, "1.0.0", "s1"),
+        HealthSample(1, day - 40, False, 503, 30.0, "1.0.1", "s1"),
+        HealthSample(1, day + 10, False, None, None, None, None),
+    ]
+    await history.record(samples)
+
+    points = await history.query(1, day - 3600, day + 60, Resolution.MINUTE)
+    assert [point["timestamp"] for point in points] == [day - 60, day]
+    first, second = points
+    assert (first["checks"], first["failures"]) == (2, 1)
+    assert first["avg_latency_ms"] == pytest.approx(20.0)
+    assert first["release"] == "1.0.1" and first["release_changed"]
+    assert not first["schema_changed"]
+    assert (second["checks"], second["failures"]) == (1, 1)
+    assert second["avg_latency_ms"] is None
+
+    hours = await history.query(1, day - 7200, day + 60, Resolution.HOUR)
+    assert sum(point["checks"] for point in hours) == 3
+
+
+@pytest.mark.anyio
+async def test_buckets_share_a_few_keys_per_service(history):
+    now = time.time()
+    await history.record(
+        [HealthSample(7, now - minute * 60, True, 200, 1.0) for minute in range(120)]
+    )
+    keys = await history.get_redis().keys("health:*:7:*")
+    # A day of minutes per hash and 30 days of hours per hash
+    assert len(keys) <= 4
+    for key in keys:
+        assert await history.get_redis().ttl(key) > 0
+    points = await history.query(7, now - 7200, now, Resolution.MINUTE)
+    assert sum(point["checks"] for point in points) == 120
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.leader import LeaderLease
+
+from .conftest import wait_for
+
+
+class Jobs:
+    def __init__(self):
+        self.running = False
+
+    async def start(self):
+        self.running = True
+
+    async def stop(self):
+        self.running = False
+
+
+def lease(jobs: Jobs) -> LeaderLease:
+    return LeaderLease(jobs.start, jobs.stop, ttl=0.3, enabled=True)
+
+
+@pytest.mark.anyio
+async def test_one_process_is_elected(redis_server):
+    jobs = [Jobs(), Jobs()]
+    leases = [lease(job) for job in jobs]
+    for leader in leases:
+        leader.start()
+    try:
+        await wait_for(lambda: any(leader.is_leader for leader in leases))
+        # Several renewals later, still exactly one leader
+        await asyncio.sleep(1)
+        assert [job.running for job in jobs].count(True) == 1
+        assert [leader.is_leader for leader in leases].count(True) == 1
+    finally:
+        for leader in leases:
+            await leader.stop()
+    assert not any(job.running for job in jobs)
+
+
+@pytest.mark.anyio
+async def test_another_process_takes_over(redis_server):
+    first, second = Jobs(), Jobs()
+    first_lease = lease(first)
+    first_lease.start()
+    await wait_for(lambda: first.running)
+
+    second_lease = lease(second)
+    second_lease.start()
+    try:
+        await first_lease.stop()
+        assert not first.running
+        await wait_for(lambda: second.running)
+    finally:
+        await second_lease.stop()
+
+
+@pytest.mark.anyio
+async def test_disabled_lease_always_leads():
+    jobs = Jobs()
+    leader = LeaderLease(jobs.start, jobs.stop, enabled=False)
+    leader.start()
+    await wait_for(lambda: jobs.running)
+    await leader.stop()
+    assert not jobs.running
@@ -0,0 +1,47 @@
+import json
+import logging
+import queue
+
+from app.logging_config import JsonFormatter, RecordQueueHandler
+
+
+def queued_record(log) -> logging.LogRecord:
+    handler = RecordQueueHandler(queue.SimpleQueue())
+    logger = logging.getLogger("tests.logging_config")
+    logger.propagate = False
+    logger.handlers = [handler]
+    try:
+        log(logger)
+    finally:
+        logger.handlers = []
+    return handler.queue.get_nowait()
+
+
+def test_exception_is_a_separate_json_field():
+    def log(logger):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("Sweep %d failed", 3, extra={"service_id": 7})
+
+    record = queued_record(log)
+    # Queued with the traceback rendered, not the frames
+    assert record.exc_info is None
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Sweep 3 failed"
+    assert entry["service_id"] == 7
+    assert entry["exception"].startswith("Traceback")
+    assert "ZeroDivisionError" in entry["exception"]
+
+
+def test_text_output_keeps_the_traceback():
+    def log(logger):
+        try:
+            raise ValueError("bad payload")
+        except ValueError:
+            logger.exception("Parse failed")
+
+    text = logging.Formatter("%(message)s").format(queued_record(log))
+    assert text.startswith("Parse failed\nTraceback")
+    assert text.endswith("ValueError: bad payload")
@@ -0,0 +1,40 @@
+from typing import List, Optional
+
+import pytest
+
+from app.websocket import RedisBroadcastBackend
+
+from .conftest import wait_for
+
+
+class RecordingManager:
+    def __init__(self):
+        self.delivered = []
+
+    def deliver(self, message: dict, topics: Optional[List[str]]):
+        self.delivered.append((message, topics))
+
+
+@pytest.mark.anyio
+async def test_publish_reaches_every_process(redis_server):
+    managers = [RecordingManager(), RecordingManager()]
+    backends = [RedisBroadcastBackend(manager) for manager in managers]
+    for backend in backends:
+        backend.start()
+    try:
+        await wait_for(lambda: all(backend.subscribed for backend in backends))
+        message = {"type": "service_update", "service": {"id": 1}}
+        assert await backends[0].publish(["services"], message)
+
+        await wait_for(lambda: all(manager.delivered for manager in managers))
+        for manager in managers:
+            assert manager.delivered == [(message, ["services"])]
+    finally:
+        for backend in backends:
+            await backend.stop()
+
+
+@pytest.mark.anyio
+async def test_publish_falls_back_before_subscribing(redis_server):
+    backend = RedisBroadcastBackend(RecordingManager())
+    assert not await backend.publish(None, {"type": "service_update"})
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+from app.websocket import SERVICE_UPDATE_EVENT, OverflowPolicy, WebSocketManager
+
+from .conftest import wait_for
+
+
+class BlockedWebSocket:
+    """
+    Client that does not read until released, so its send queue fills up
+    """
+
+    def __init__(self):
+        self.released = asyncio.Event()
+        self.received = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        await self.released.wait()
+        self.received.append(json.loads(text))
+
+
+def service_update(**fields) -> dict:
+    return {"type": SERVICE_UPDATE_EVENT, "service": {"id": 1, **fields}}
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "policy", [OverflowPolicy.DROP_OLDEST, OverflowPolicy.COALESCE]
+)
+async def test_frame_after_a_dropped_frame_is_a_keyframe(policy):
+    manager = WebSocketManager(
+        queue_size=2,
+        overflow_policy=policy,
+        backend="local",
+        coalesce_window=0,
+        keyframe_interval=100,
+    )
+    websocket = BlockedWebSocket()
+    await manager.connect(websocket, ["service:1"])
+
+    manager.deliver(service_update(version="1"))
+    # The writer takes the first frame and blocks sending it
+    await asyncio.sleep(0)
+    # Deltas 2 and 3 fill the queue; delta 4 evicts delta 2
+    for version in ("2", "3", "4"):
+        manager.deliver(service_update(version=version))
+    assert manager.dropped == 1
+    # Delta 3 evicted; 5 must not build on the missing 2
+    manager.deliver(service_update(version="5"))
+
+    websocket.released.set()
+    await wait_for(lambda: len(websocket.received) == 3)
+    first, delta, last = websocket.received
+    assert first["keyframe"] and first["seq"] == 1
+    assert delta["seq"] == 4 and "keyframe" not in delta
+    assert last["keyframe"] and last["seq"] == 5
+    assert last["service"] == {"id": 1, "version": "5"}
+    manager.disconnect(websocket)
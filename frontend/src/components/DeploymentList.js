@@ -1,12 +1,11 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { serviceApi } from '../services/api';
 import { Alert } from './Alert';
 import { Filter, RefreshCw } from 'lucide-react';
 import { useWebSocket } from '../hooks/useWebSocket';
 
 const AUTO_REFRESH_INTERVAL = 120000; // 2 minutes
-const POLLING_INTERVAL = 2000; // 2 seconds
-const POLLING_TIMEOUT = 60000; // 1 minute
+const ACTIVE_STATUSES = ['pending', 'in_progress'];
 
 const StatusBadge = ({ status }) => {
     const styles = {
@@ -32,8 +31,9 @@ export const DeploymentList = () => {
         service: 'all',
         status: 'all'
     });
-    const [pollingDeployments, setPollingDeployments] = useState(new Set());
     const { isConnected, addMessageListener } = useWebSocket('ws://localhost:8000/ws');
+    const deploymentsRef = useRef(deployments);
+    deploymentsRef.current = deployments;
 
     const loadData = useCallback(async () => {
         try {
@@ -64,81 +64,57 @@ export const DeploymentList = () => {
         }
     }, []);
 
-    const pollDeployment = useCallback(async (deploymentId) => {
-        if (!pollingDeployments.has(deploymentId)) return null;
-
-        try {
-            const response = await serviceApi.getDeploymentStatus(deploymentId);
-            console.log(`Polling deployment ${deploymentId}:`, response.data);
-
-            if (response.data.status !== 'in_progress') {
-                setPollingDeployments(prev => {
-                    const next = new Set(prev);
-                    next.delete(deploymentId);
-                    return next;
-                });
-                await loadData();
-                return response.data.status;
-            }
-            return 'in_progress';
-        } catch (error) {
-            console.error(`Error polling deployment ${deploymentId}:`, error);
-            setPollingDeployments(prev => {
-                const next = new Set(prev);
-                next.delete(deploymentId);
-                return next;
-            });
-            return 'error';
-        }
-    }, [pollingDeployments, loadData]);
-
     useEffect(() => {
         loadData();
     }, [loadData]);
 
+    // Fallback for completions that were not pushed: one batched status
+    // request for the unfinished deployments instead of a full reload
+    const refreshStatuses = useCallback(async () => {
+        const activeIds = deploymentsRef.current
+            .filter(deployment => ACTIVE_STATUSES.includes(deployment.status))
+            .map(deployment => deployment.id);
+        if (activeIds.length === 0) {
+            return;
+        }
+        try {
+            const response = await serviceApi.getDeploymentStatuses(activeIds);
+            const statuses = new Map(response.data.map(status => [status.id, status]));
+            setDeployments(prev => prev.map(deployment => {
+                const status = statuses.get(deployment.id);
+                return status
+                    ? { ...deployment, status: status.status, completed_at: status.completed_at }
+                    : deployment;
+            }));
+        } catch (err) {
+            console.error('Error refreshing deployment statuses:', err);
+        }
+    }, []);
+
     // Auto refresh
     useEffect(() => {
         const intervalId = setInterval(() => {
-            loadData();
+            refreshStatuses();
         }, AUTO_REFRESH_INTERVAL);
 
         return () => clearInterval(intervalId);
-    }, [loadData]);
+    }, [refreshStatuses]);
 
     // WebSocket handler
     useEffect(() => {
         const handleDeploymentUpdate = async (data) => {
             console.log('WebSocket message received:', data);
 
-            if (data.type === 'deployment_started') {
-                setPollingDeployments(prev => new Set([...prev, data.deployment_id]));
-                
-                const startTime = Date.now();
-                const pollInterval = setInterval(async () => {
-                    if (Date.now() - startTime >= POLLING_TIMEOUT) {
-                        clearInterval(pollInterval);
-                        setPollingDeployments(prev => {
-                            const next = new Set(prev);
-                            next.delete(data.deployment_id);
-                            return next;
-                        });
-                        await loadData();
-                        return;
-                    }
-
-                    const status = await pollDeployment(data.deployment_id);
-                    if (status && status !== 'in_progress') {
-                        clearInterval(pollInterval);
-                    }
-                }, POLLING_INTERVAL);
-
-            } else if (data.type === 'deployment_completed' || data.type === 'deployment_update') {
+            // Deployment completion is pushed by the server, no polling needed
+            if (data.type === 'deployment_started' ||
+                data.type === 'deployment_completed' ||
+                data.type === 'deployment_update') {
                 await loadData();
             }
         };
 
         addMessageListener(handleDeploymentUpdate);
-    }, [addMessageListener, loadData, pollDeployment]);
+    }, [addMessageListener, loadData]);
 
     const handleFilterChange = (key, value) => {
         setFilters(prev => ({
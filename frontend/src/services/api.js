@@ -26,18 +26,34 @@ const createApi = (token = null) => {
 
 export const createAuthenticatedApi = (token) => {
     const api = createApi(token);
+
+    // Follows the keyset cursor until every page has been fetched
+    const getAllPages = async (url) => {
+        const items = [];
+        let afterId = null;
+        do {
+            const response = await api.get(url, {
+                params: { limit: 1000, ...(afterId && { after_id: afterId }) }
+            });
+            items.push(...response.data);
+            afterId = response.headers['x-next-after-id'];
+        } while (afterId);
+        return { data: items };
+    };
     
     return {
         // Services
-        getAllServices: () => api.get('/services/'),
+        getAllServices: () => getAllPages('/services/'),
         createService: (data) => api.post('/services/', data),
         getService: (id) => api.get(`/services/${id}`),
-        getServiceDeployments: (id) => api.get(`/services/${id}/deployments/`),
+        getServiceDeployments: (id) => getAllPages(`/services/${id}/deployments/`),
         
         // Deployments
         createDeployment: (serviceId, data) => 
             api.post(`/services/${serviceId}/deployments/`, data),
         getDeploymentStatus: (id) => api.get(`/deployments/${id}/status`),
+        getDeploymentStatuses: (ids) =>
+            api.get('/deployments/status', { params: { ids: ids.join(',') } }),
     };
 };
 